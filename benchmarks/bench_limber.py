@@ -0,0 +1,83 @@
+# Reports the time (in micro-seconds) per limb.computeCggCkg call, for
+# the current implementation (precomputed quadrature weights and ell
+# resampling matrix) and for the original per-monomial spline + simpson
+# implementation (reproduced in legacyCggCkg below). Uses analytic toy
+# power spectra and background, so that CLASS and the HEFT emulator
+# are not required, on the grid used by the likelihood (Nz=80).
+#
+# Run from this directory: python bench_limber.py
+import numpy as np
+import sys
+from time import perf_counter
+from scipy.integrate   import simpson
+from scipy.interpolate import InterpolatedUnivariateSpline as Spline
+sys.path.append('../')
+from theory.limber import limb
+
+# toy ingredients
+k   = np.logspace(-3,1,300)
+Pk  = lambda z: 2e4*(k/0.02)/(1+(k/0.02)**2.5)/(1+z)**2
+def background(thy_args,zs):
+   zz  = np.linspace(0,20,20000)
+   Ez  = lambda z: np.sqrt(0.3*(1+z)**3+0.7)
+   f   = 1./Ez(zz)
+   chi = np.concatenate(([0.],np.cumsum(0.5*(f[1:]+f[:-1])*np.diff(zz))))*2997.92458
+   return 0.3,9400.,Ez(zs),np.interp(zs,zz,chi)
+def Pmm(thy_args,zs): return np.array([k]+[Pk(z) for z in np.atleast_1d(zs)]).T
+def Pgm(thy_args,z):  return np.array([k,thy_args[6]*Pk(z),-0.5*k**2*Pk(z)]).T
+def Pgg(thy_args,z):  return np.array([k,thy_args[6]**2*Pk(z),-0.5*k**2*Pk(z)]).T
+
+def legacyCggCkg(L, i, thy_args, smag, ext=3):
+   """
+   The original (loop-based) computeCggCkg.
+   """
+   chi,Wk,Wg_clust,Wg_mag,PgmT,PggT,PmmT,_ = L.evaluate(i, thy_args)
+   kgrid = L.kgrid(chi)
+   Wg_clust = Wg_clust[:,i] ; Wg_mag = Wg_mag[:,i]
+   Nmono_auto = PggT.shape[1]-1 ; Nmono_cros = PgmT.shape[1]-1
+   PggIntrp = np.zeros(kgrid.shape+(Nmono_auto,))
+   PgmIntrp = np.zeros(kgrid.shape+(Nmono_cros,))
+   for j in range(Nmono_auto): PggIntrp[:,:,j] = Spline(PggT[:,0],PggT[:,j+1],ext=ext)(kgrid)
+   for j in range(Nmono_cros): PgmIntrp[:,:,j] = Spline(PgmT[:,0],PgmT[:,j+1],ext=ext)(kgrid)
+   Pgrid = np.zeros((L.Nz,L.Nlval))
+   for j in range(L.Nz): Pgrid[j,:] = Spline(PmmT[:,0],PmmT[:,j+1],ext=1)(kgrid[j,:])
+   Nmono_tot = 1 + Nmono_auto + (Nmono_cros-1)
+   def reshape_kernel(kernel): return np.repeat(kernel/chi**2.,L.Nlval).reshape(kgrid.shape)
+   Cgg = np.ones((L.Nl,Nmono_tot))
+   integrand  = reshape_kernel(Wg_clust**2)                  * PggIntrp[:,:,0]
+   integrand += 2*(5*smag-2)*reshape_kernel(Wg_mag*Wg_clust) * PgmIntrp[:,:,0]
+   integrand += (5*smag-2)**2*reshape_kernel(Wg_mag**2)      * Pgrid
+   Cgg[:,0]   = Spline(L.lval,simpson(integrand,x=chi,axis=0))(L.l)
+   for j in range(Nmono_auto-1):
+      integrand  = reshape_kernel(Wg_clust**2) * PggIntrp[:,:,j+1]
+      Cgg[:,j+1] = Spline(L.lval,simpson(integrand,x=chi,axis=0))(L.l)
+   for j in range(Nmono_cros-1):
+      integrand = 2*(5*smag-2)*reshape_kernel(Wg_clust*Wg_mag) * PgmIntrp[:,:,j+1]
+      Cgg[:,j+1+Nmono_auto] = Spline(L.lval,simpson(integrand,x=chi,axis=0))(L.l)
+   Ckg = np.zeros((L.Nl,Nmono_tot))
+   integrand  = reshape_kernel(Wk*Wg_clust)          * PgmIntrp[:,:,0]
+   integrand += (5*smag-2)*reshape_kernel(Wk*Wg_mag) * Pgrid
+   Ckg[:,0]   = Spline(L.lval,simpson(integrand,x=chi,axis=0))(L.l)
+   for j in range(Nmono_cros-1):
+      integrand = reshape_kernel(Wk*Wg_clust) * PgmIntrp[:,:,j+1]
+      Ckg[:,j+1+Nmono_auto] = Spline(L.lval,simpson(integrand,x=chi,axis=0))(L.l)
+   return Cgg,Ckg
+
+def timeit(func,Nrep=50):
+   func()
+   t0 = perf_counter()
+   for i in range(Nrep): res = func()
+   return 1e6*(perf_counter()-t0)/Nrep,res
+
+if __name__ == '__main__':
+   z    = np.linspace(0.,1.5,200)
+   dNdz = np.array([z,np.exp(-(z-0.5)**2/0.02),np.exp(-(z-0.8)**2/0.03)]).T
+   thy  = np.array([0.022,0.1202,0.9667,3.045,67.27,0.06,1.5,0.,0.])
+   L    = limb(dNdz, thy, Pgm, Pgg, Pmm, background, zmin=0.001, zmax=1.8, Nz=80)
+   told,(Cgg0,Ckg0) = timeit(lambda: legacyCggCkg(L,0,thy,0.4))
+   tnew,(Cgg1,Ckg1) = timeit(lambda: L.computeCggCkg(0,thy,0.4))
+   print(f'(Nz,Nlval,Nl) = ({L.Nz},{L.Nlval},{L.Nl})')
+   print(f'before: {told:10.1f} us per computeCggCkg')
+   print(f'after : {tnew:10.1f} us per computeCggCkg')
+   print(f'max |rel diff| (Cgg[:,0], ell>=10): {np.max(np.abs(Cgg1[10:,0]/Cgg0[10:,0]-1)):.2e}')
+   print(f'max |rel diff| (Ckg[:,0], ell>=10): {np.max(np.abs(Ckg1[10:,0]/Ckg0[10:,0]-1)):.2e}')
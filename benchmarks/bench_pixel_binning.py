@@ -0,0 +1,61 @@
+# Times the binning of a chunk of (random) pixel indices into a healpix
+# map with the original np.histogram approach (weighted and unweighted
+# maps from two calls, as in make_lrg_maps.py), np.add.at (as in the
+# WebSky mocks) and maps/pixel_counts.py (dense, and sparse over the 
+# occupied pixels only), for NSIDE 1024, 2048 and 4096.
+# np.histogram is only timed (once) up to NSIDE 2048, since it takes
+# minutes per call at NSIDE 4096.
+#
+# Run from this directory: python bench_pixel_binning.py [Nobj]
+import numpy as np
+import sys
+from time import perf_counter
+sys.path.append('../maps/')
+from pixel_counts import pixel_sums
+
+def timeit(func,Nrep=3):
+   func()
+   t0 = perf_counter()
+   for i in range(Nrep): res = func()
+   return 1e3*(perf_counter()-t0)/Nrep,res
+
+def histogram(pixnum,wt,npix):
+   rmap,_ = np.histogram(pixnum,weights=wt,bins=np.arange(npix+1)-0.5)
+   wmap,_ = np.histogram(pixnum,bins=np.arange(npix+1)-0.5)
+   return wmap,rmap
+
+def add_at(pixnum,wt,npix):
+   rmap = np.zeros(npix)
+   wmap = np.zeros(npix)
+   np.add.at(rmap,pixnum,wt)
+   np.add.at(wmap,pixnum,1.)
+   return wmap,rmap
+
+def sparse(pixnum,wt,npix):
+   pix,counts,wsum = pixel_sums(pixnum,npix,wt,sparse=True)
+   wmap = np.zeros(npix) ; wmap[pix] = counts
+   rmap = np.zeros(npix) ; rmap[pix] = wsum
+   return wmap,rmap
+
+if __name__ == '__main__':
+   Nobj = int(sys.argv[1]) if len(sys.argv)>1 else 2000000
+   rng  = np.random.default_rng(42)
+   print(f'Nobj = {Nobj:d}, times in ms')
+   print(f'{"NSIDE":>6s} {"histogram":>10s} {"add.at":>10s} {"bincount":>10s} {"sparse":>12s}')
+   for nside in [1024,2048,4096]:
+      npix   = 12*nside**2
+      # a footprint covering ~1/3 of the sky
+      pixnum = rng.integers(0,npix//3,size=Nobj)
+      wt     = rng.uniform(0.8,1.2,size=Nobj)
+      ta,(w0,r0) = timeit(lambda: add_at(pixnum,wt,npix))
+      tb,(w1,r1) = timeit(lambda: pixel_sums(pixnum,npix,wt))
+      tc,(w2,r2) = timeit(lambda: sparse(pixnum,wt,npix))
+      th = np.nan
+      if nside <= 2048:
+         t0 = perf_counter()
+         w3,r3 = histogram(pixnum,wt,npix)
+         th = 1e3*(perf_counter()-t0)
+         assert np.array_equal(w3,w0) and np.allclose(r3,r0)
+      for w,r in [(w1,r1),(w2,r2)]:
+         assert np.array_equal(w,w0) and np.allclose(r,r0)
+      print(f'{nside:6d} {th:10.1f} {ta:10.1f} {tb:10.1f} {tc:12.1f}',flush=True)
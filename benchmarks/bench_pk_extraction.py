@@ -0,0 +1,40 @@
+# Compares the wall time of extracting a (Nk,Nz) halofit Pmm table
+# from CLASS with a per-(k,z) Python loop (the old pmmHalofit) against
+# the bulk array interface used by pkCodes.pkTable, on the default
+# limb redshift grid used by the likelihood (Nz=80).
+#
+# Run from this directory: python bench_pk_extraction.py
+import numpy as np
+import sys
+from time import perf_counter
+sys.path.append('../')
+from theory.classyCache import getCosmo
+from theory.pkCodes     import pkTable
+
+thy_args = [0.022,0.1202,0.9667,3.045,67.27,0.06] # omb,omc,ns,ln(1e10 As),H0,Mnu
+k        = np.logspace(np.log10(0.005),np.log10(5.),200)
+z        = np.linspace(0.001,1.8,80)
+Nrep     = 5
+
+def loop(cosmo):
+   h  = cosmo.h()
+   Pk = lambda zz: np.array([cosmo.pk(kk*h,zz)*h**3 for kk in k])
+   return np.array([Pk(zz) for zz in z]).T
+
+def bulk(cosmo):
+   return pkTable(cosmo,k,z)
+
+def timeit(func,cosmo):
+   t0 = perf_counter()
+   for i in range(Nrep): res = func(cosmo)
+   return (perf_counter()-t0)/Nrep,res
+
+if __name__ == '__main__':
+   cosmo = getCosmo(thy_args)
+   tloop,Ploop = timeit(loop,cosmo)
+   tbulk,Pbulk = timeit(bulk,cosmo)
+   print(f'(Nk,Nz) = ({len(k)},{len(z)})')
+   print(f'per-(k,z) loop : {1e3*tloop:8.2f} ms')
+   print(f'bulk array call: {1e3*tbulk:8.2f} ms')
+   print(f'speed-up       : {tloop/tbulk:8.1f}x')
+   print(f'max |rel diff| : {np.max(np.abs(Pbulk/Ploop-1)):.2e}')
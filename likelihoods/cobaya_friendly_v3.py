@@ -1,18 +1,19 @@
 import numpy as np
 import sys
-import json
 from cobaya.likelihood import Likelihood
 from scipy.interpolate import interp1d
 sys.path.append('../')
 from theory.limber               import limb 
-from theory.pkCodes              import pmmHEFT,pgmHEFT,pggHEFT
+from theory.pkCodes              import pmmHEFT,pgmHEFT,pggHEFT,pgmpggHEFT
 from theory.background           import classyBackground
 from likelihoods.gaussLikeSimple import gaussLike
 from likelihoods.pack_data_v2    import pack_cl_wl,pack_cov,pack_dndz
+from spectra.datastore           import load_data
 
 class XcorrLike(Likelihood):
     ## From yaml file
-    # .json file input (cl's, window functions and covariances)
+    # .json file (or DataStore directory) input 
+    # (cl's, window functions and covariances)
     jsonfn:   str
     # name of the CMB lensing map 
     kapNames: list
@@ -44,6 +45,9 @@ class XcorrLike(Likelihood):
     jeffreys: bool
     # maximize or sample?
     maximize:  bool
+    # fold the window functions, pixel window and ell-resampling
+    # into one (Nbandpower x Nlval) matrix per spectrum?
+    fold_windows: bool = False
     def initialize(self):
         """Sets up the class."""
         self.nsamp = len(self.galNames) # number of galaxy samples
@@ -55,7 +59,8 @@ class XcorrLike(Likelihood):
         fid_bias  = [0.9,0.,0.]                            # b1, b2, bs
         fid = np.array(fid_cosmo+fid_bias)
         # set up the theory prediction class.
-        self.clPred = limb(self.dndz, fid, pgmHEFT, pggHEFT, pmmHEFT, classyBackground, zmin=0.001, zmax=1.8, Nz=80)
+        self.clPred = limb(self.dndz, fid, pgmHEFT, pggHEFT, pmmHEFT, classyBackground, zmin=0.001, zmax=1.8, Nz=80, PgmPgg=pgmpggHEFT)
+        if self.fold_windows: self.foldWindows()
         # set up the gaussian likelihood class.
         # requires (Gaussian = [mu,sigma]) priors on our three templates 
         # (for each galaxy sample) which are analytically marginalized over.
@@ -87,18 +92,34 @@ class XcorrLike(Likelihood):
         
     def loadData(self):
         """
-        Load the data from json file, stack and apply scale cuts.
-        Also load window functions and make dndz matrix.
+        Load the data from json file (or DataStore), stack and apply 
+        scale cuts. Also load window functions and make dndz matrix.
         """
-        # load the json file containing cl's, window functions, and covariances
-        with open(self.jsonfn) as outfile:
-            jsondata = json.load(outfile)
+        # load the json file (or DataStore) containing cl's, window functions, 
+        # and covariances. DataStore arrays are memory-mapped and only
+        # read when needed.
+        jsondata = load_data(self.jsonfn)
         self.wla,self.wlx,self.data = pack_cl_wl(jsondata,self.kapNames,self.galNames,self.amin,self.amax,self.xmin,self.xmax)
         self.cov  =                   pack_cov(  jsondata,self.kapNames,self.galNames,self.amin,self.amax,self.xmin,self.xmax)
         dndzs     = [np.loadtxt(self.dndzfns[i]) for i in range(self.nsamp)]
         self.dndz = pack_dndz(dndzs)
         self.pixwin = np.array(jsondata['pixwin'])
 
+    def foldWindows(self):
+        """
+        Pre-multiplies the window functions, the pixel window and the
+        ell-resampling operator of clPred (which maps Cells evaluated
+        at clPred.lval to every ell up to lmax) into a single 
+        (Nbandpower,Nlval) matrix per spectrum, such that the binned 
+        predictions can be computed directly from the sampled ell's.
+        """
+        Rl = self.clPred.Rl
+        Nl = Rl.shape[0]
+        pw = self.pixwin[:Nl]
+        self.fwla       = [np.dot(self.wla[i][:,:Nl]*pw**2,Rl) for i in range(self.nsamp)]
+        self.fwla_nopix = [np.dot(self.wla[i][:,:Nl],Rl)       for i in range(self.nsamp)]
+        self.fwlx       = [[np.dot(self.wlx[j][i][:,:Nl]*pw,Rl) for i in range(self.nsamp)] for j in range(self.nkap)]
+
     def get_cosmo_parameters(self):
         pp  = self.provider
         omb = pp.get_param('omega_b')
@@ -125,31 +146,46 @@ class XcorrLike(Likelihood):
         # (1, alpha_a(z1), SN(z1), alpha_x(z1), alpha_a(z2), SN(z2), alpha_x(z2), ...)
         """
         omb,omc,ns,As,H0,Mnu = self.get_cosmo_parameters()
+        nuisance  = [self.get_nuisance_parameters(i) for i in range(self.nsamp)]
+        params    = [np.array([omb,omc,ns,As,H0,Mnu,b1,b2,bs]) for b1,b2,bs,smag in nuisance]
+        smags     = [smag for b1,b2,bs,smag in nuisance]
+        # Cggs and Ckgs are tables of shape (nsamp,nell,4)
+        # where the four columns correspond to 
+        # 1, alpha_auto, shot noise, alpha_cross
+        # (all samples are computed in one pass)
+        # When the windows are folded, the tables are evaluated at the
+        # sampled ell's (clPred.lval) and binned with the folded windows.
+        Cggs,Ckgs = self.clPred.computeAllCggCkg(params,smags,resample=not self.fold_windows)
         full_pred = []
-        Nls       = []
         for i,suf in enumerate(self.galNames):
-            b1,b2,bs,smag = self.get_nuisance_parameters(i)
-            params = np.array([omb,omc,ns,As,H0,Mnu,b1,b2,bs])
-            # Cgg and Ckg are tables of shape (nell,4)
-            # where the four columns correspond to 
-            # 1, alpha_auto, shot noise, alpha_cross
-            Cgg,Ckg = self.clPred.computeCggCkg(i,params,smag)
+            b1      = nuisance[i][0]
+            Cgg,Ckg = Cggs[i],Ckgs[i]
             if self.chenprior:
                 Cgg[:,1] += Cgg[:,3]/(2.*(1.+b1))
                 Ckg[:,1] += Ckg[:,3]/(2.*(1.+b1))
-            Nkg = Ckg.shape[0] ; Ngg = Cgg.shape[0]
-            # correct for pixel window function
-            # shot noise is left untouched
-            pixwin_idxs = [0,1,3] 
-            for idx in pixwin_idxs:
-                Ckg[:,idx] = Ckg[:,idx]*self.pixwin[:Nkg]
-                Cgg[:,idx] = Cgg[:,idx]*self.pixwin[:Ngg]**2
-            # multiply by the "mask window"
-            wa     = self.wla[i][:,:Ngg]
-            Cggkgs = np.dot(wa,Cgg)
-            for j in range(self.nkap):
-                wx     = self.wlx[j][i][:,:Nkg]
-                Cggkgs = np.concatenate((Cggkgs,np.dot(wx,Ckg)))
+            if self.fold_windows:
+                # pixel window already included in the folded windows
+                # (shot noise is binned without it)
+                pixwin_idxs = [0,1,3]
+                Cggkgs      = np.empty((self.fwla[i].shape[0],Cgg.shape[1]))
+                Cggkgs[:,pixwin_idxs] = np.dot(self.fwla[i],Cgg[:,pixwin_idxs])
+                Cggkgs[:,2] = np.dot(self.fwla_nopix[i],Cgg[:,2])
+                for j in range(self.nkap):
+                    Cggkgs = np.concatenate((Cggkgs,np.dot(self.fwlx[j][i],Ckg)))
+            else:
+                Nkg = Ckg.shape[0] ; Ngg = Cgg.shape[0]
+                # correct for pixel window function
+                # shot noise is left untouched
+                pixwin_idxs = [0,1,3] 
+                for idx in pixwin_idxs:
+                    Ckg[:,idx] = Ckg[:,idx]*self.pixwin[:Nkg]
+                    Cgg[:,idx] = Cgg[:,idx]*self.pixwin[:Ngg]**2
+                # multiply by the "mask window"
+                wa     = self.wla[i][:,:Ngg]
+                Cggkgs = np.dot(wa,Cgg)
+                for j in range(self.nkap):
+                    wx     = self.wlx[j][i][:,:Nkg]
+                    Cggkgs = np.concatenate((Cggkgs,np.dot(wx,Ckg)))
             # stack the data vector
             Nl,Nmon = Cggkgs.shape
             res = np.zeros((Nl,1+(Nmon-1)*self.nsamp))
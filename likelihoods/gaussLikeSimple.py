@@ -1,9 +1,28 @@
 import numpy as np
-from   numpy.random import multivariate_normal as normal
 from   scipy.stats  import chi2                as CHI2
+from   scipy.linalg import cholesky,solve_triangular,cho_solve
 
 pte = lambda chi2,dof: 1.-CHI2.cdf(chi2,df=dof)
 
+def solveTriBatch(L, b, trans=False):
+   """
+   Solves L x = b (or L^T x = b if trans) for a stack of lower 
+   triangular matrices L, (N,T,T) ndarray, and right-hand sides 
+   b, (N,T) or (N,T,K) ndarray, by forward (back) substitution 
+   that is vectorized over the stack, i.e. O(N T^2) operations 
+   per right-hand side.
+   """
+   x     = np.array(b,dtype=float)
+   vec   = (x.ndim == 2)
+   if vec: x = x[:,:,None]
+   T     = L.shape[1]
+   order = range(T-1,-1,-1) if trans else range(T)
+   for i in order:
+      if trans: x[:,i] -= np.einsum('nj,njk->nk',L[:,i+1:,i],x[:,i+1:])
+      else:     x[:,i] -= np.einsum('nj,njk->nk',L[:,i,:i],x[:,:i])
+      x[:,i] /= L[:,i,i,None]
+   return x[:,:,0] if vec else x
+
 class gaussLike():
    """
    A Gaussian likelihood class. 
@@ -14,6 +33,11 @@ class gaussLike():
    templates (mutiplied by linear coefficients) is required, 
    all log-likelihoods correspond to the ("raw" likelihood) x 
    (the priors of the template coefficients), up to a constant.
+   
+   All chi2's are computed in the "whitened" basis defined by the 
+   Cholesky factor of the covariance (cov = L L^T), which is computed
+   once. The data (L^{-1} dat) is whitened once, while the theory is
+   whitened with a single triangular solve per call.
    """
    def __init__(self, dat, cov, tmp_priors=None, jeffreys=False):
       """
@@ -35,13 +59,27 @@ class gaussLike():
       """
       
       self.dat        = dat
-      self.cinv       = np.linalg.inv(cov)
+      self.L          = cholesky(cov,lower=True)
+      self.wdat       = self.whiten(dat)
       self.tmp_priors = tmp_priors
       self.D          = len(dat)
       self.T          = 0
       self.jeff       = jeffreys
       if tmp_priors is not None:
          self.T       = tmp_priors.shape[0]
+         self.CphiInv = np.diag(self.tmp_priors[:,1]**-2.)
+         self.Vprior  = np.dot(self.CphiInv,self.tmp_priors[:,0])
+
+   def whiten(self, x):
+      """
+      Returns L^{-1} x, where cov = L L^T, such that 
+      x^T cov^{-1} y = np.dot(whiten(x),whiten(y)).
+      
+      Parameters
+      ----------
+      x : (D) OR (D,N) ndarray
+      """
+      return solve_triangular(self.L,x,lower=True,check_finite=False)
 
    def templatePrior(self,tmp_prm):
       """
@@ -53,7 +91,7 @@ class gaussLike():
       tmp_prm : (T) ndarray
          values of the T template coefficients
       """
-      if self.T == 0.: return 1.
+      if self.T == 0.: return 0.
       delt   = np.array(tmp_prm) - self.tmp_priors[:,0]
       chi2   = np.sum((delt/self.tmp_priors[:,1])**2.)
       return -0.5*chi2 
@@ -87,17 +125,25 @@ class gaussLike():
          monomials = np.array([1.]+list(tmp_prm))
          full_thy  = np.dot(thy, monomials)
       
-      delt = full_thy - self.dat
-      chi2 = np.dot(delt,np.dot(self.cinv,delt))
-      res  = -0.5*chi2 + self.templatePrior(tmp_prm)
+      wdelt = self.whiten(full_thy) - self.wdat
+      chi2  = np.dot(wdelt,wdelt)
+      res   = -0.5*chi2 + self.templatePrior(tmp_prm)
       if self.jeff:
-         _,M,_ = self.anaHelp(thy)
-         res  -= 0.5*np.log(np.linalg.det(M))
+         # -0.5 log det(M) = +0.5 log det(Minv)
+         _,_,Lm,_ = self.anaChol(thy)
+         res  += np.sum(np.log(np.diag(Lm)))
       return res
 
-   def anaHelp(self, thy):
+   def anaChol(self, thy):
       """
-      Helper function for margLogLike and maxLogLike
+      Helper function for margLogLike and maxLogLike. Returns 
+      
+      wdelt  # whitened residual of the template-free theory, (D) ndarray
+      wB     # whitened templates, (D,T) ndarray
+      Lm     # lower Cholesky factor of Minv = CphiInv + B^T cov^{-1} B, (T,T) ndarray
+      V      # B^T cov^{-1} delt - CphiInv mu, (T) ndarray
+      
+      where M = Minv^{-1} is the covariance of the template coefficients.
 
       Parameters
       ----------
@@ -109,20 +155,34 @@ class gaussLike():
       RuntimeError
          If this function is called when there
          are no templates (T=0)
+      numpy.linalg.LinAlgError
+         If Minv is not positive definite
       """
       if self.T == 0.: 
-         s = "anaHelp should never need to be called"
+         s = "anaChol should never need to be called"
          s += " when there are no templates"
          raise RuntimeError(s)
-       
-      A = thy[:,0]
-      B = thy[:,1:]
-      delt = A - self.dat
-      CphiInv = np.diag(self.tmp_priors[:,1]**-2.)
-      Minv = CphiInv + np.matmul(B.T,np.matmul(self.cinv,B))
-      M = np.linalg.inv(Minv)
-      V = [np.dot(B[:,i],np.dot(self.cinv,delt)) for i in range(self.T)]
-      V = np.array(V) - np.dot(CphiInv,self.tmp_priors[:,0])
+      
+      W     = self.whiten(thy)
+      wdelt = W[:,0] - self.wdat
+      wB    = W[:,1:]
+      Minv  = self.CphiInv + np.dot(wB.T,wB)
+      Lm    = cholesky(Minv,lower=True)
+      V     = np.dot(wB.T,wdelt) - self.Vprior
+      return wdelt,wB,Lm,V
+
+   def anaHelp(self, thy):
+      """
+      Returns delt (= thy[:,0] - dat), M and V (see anaChol).
+
+      Parameters
+      ----------
+      thy: ndarray
+         theory prediction tables
+      """
+      _,_,Lm,V = self.anaChol(thy)
+      delt = thy[:,0] - self.dat
+      M    = cho_solve((Lm,True),np.eye(self.T))
       return delt,M,V
 
    def margLogLike(self, thy):
@@ -135,20 +195,17 @@ class gaussLike():
          theory prediction tables
       """
       if self.T == 0.: 
-         return self.rawLogLike()
-         
-      delt,M,V = self.anaHelp(thy)
-      chi2     = np.dot(delt,np.dot(self.cinv,delt))
-      chi2     = chi2-np.dot(V,np.dot(M,V))
+         return self.rawLogLike(thy)
+      
       try:
-        logdetM = 0.5*np.log(np.linalg.det(M))
-      except:
-        print('Overflow, trying [log det(M) = sum log eigvals] instead')
-        eigvals = np.linalg.eigvalsh(M)
-        if np.any(eigvals<0):
-            print('Found negative eigenvalues')
-            return np.nan
-        logdetM = 0.5*np.sum(np.log(eigvals))
+         wdelt,wB,Lm,V = self.anaChol(thy)
+      except np.linalg.LinAlgError:
+         print('Minv is not positive definite')
+         return np.nan
+      # V^T M V = |Lm^{-1} V|^2 and 0.5 log det(M) = -sum log diag(Lm)
+      LmV     = solve_triangular(Lm,V,lower=True,check_finite=False)
+      chi2    = np.dot(wdelt,wdelt) - np.dot(LmV,LmV)
+      logdetM = -np.sum(np.log(np.diag(Lm)))
       res = -0.5*chi2 + logdetM*(not self.jeff)
       return res
    
@@ -162,8 +219,8 @@ class gaussLike():
       thy: ndarray
          theory prediction tables
       """
-      delt,M,V = self.anaHelp(thy)
-      tmp_prm_star = -1*np.dot(M,V)
+      _,_,Lm,V = self.anaChol(thy)
+      tmp_prm_star = -1*cho_solve((Lm,True),V)
       return tmp_prm_star
 
    def maxLogLike(self, thy):
@@ -205,14 +262,13 @@ class gaussLike():
       thy: ndarray
          theory prediction tables
       """
-      A = thy[:,0]
-      B = thy[:,1:]
-      delt,M,V = self.anaHelp(thy)
-      X = np.array([np.dot(B[:,i],np.dot(self.cinv,delt)) for i in range(self.T)]) 
+      wdelt,wB,Lm,V = self.anaChol(thy)
+      M = cho_solve((Lm,True),np.eye(self.T))
+      X = np.dot(wB.T,wdelt)
       Y = np.dot(M,V)
-      Z = np.matmul(B.T,np.matmul(self.cinv,B))  
+      Z = np.dot(wB.T,wB)
       W = M + np.outer(Y,Y)  
-      chi2 = np.dot(np.dot(delt,self.cinv),delt)
+      chi2 = np.dot(wdelt,wdelt)
       chi2-= 2*np.dot(X,Y)
       chi2+= np.trace(np.matmul(Z,W))
       return chi2
@@ -226,14 +282,164 @@ class gaussLike():
       thy: ndarray
          theory prediction tables
       """
-      d = self.getBestFit(thy) - self.dat
-      return np.dot(np.dot(d,self.cinv),d)
+      wd = self.whiten(self.getBestFit(thy)) - self.wdat
+      return np.dot(wd,wd)
     
+   def anaCholBatch(self, thys):
+      """
+      Batched version of anaChol. Returns wdelt (N,D), wB (N,D,T), 
+      Lm (N,T,T), V (N,T) and ok (N), where ok is False for theory 
+      tables whose Minv is not positive definite (for which Lm is
+      set to the identity).
+      
+      Parameters
+      ----------
+      thys: (N,D,1+T) ndarray
+         stack of theory prediction tables
+
+      Raises
+      ------
+      RuntimeError
+         If this function is called when there
+         are no templates (T=0)
+      """
+      if self.T == 0.: 
+         s = "anaCholBatch should never need to be called"
+         s += " when there are no templates"
+         raise RuntimeError(s)
+      
+      N,D,_ = thys.shape
+      # whiten all N tables with a single triangular solve
+      W     = self.whiten(np.moveaxis(thys,0,1).reshape((D,-1)))
+      W     = np.moveaxis(W.reshape((D,N,1+self.T)),1,0)
+      wdelt = W[:,:,0] - self.wdat
+      wB    = W[:,:,1:]
+      Minv  = self.CphiInv + np.einsum('ndi,ndj->nij',wB,wB)
+      V     = np.einsum('ndi,nd->ni',wB,wdelt) - self.Vprior
+      ok    = np.ones(N,dtype=bool)
+      try:
+         Lm = np.linalg.cholesky(Minv)
+      except np.linalg.LinAlgError:
+         Lm = np.zeros_like(Minv)
+         for n in range(N):
+            try:    Lm[n] = np.linalg.cholesky(Minv[n])
+            except np.linalg.LinAlgError:
+               ok[n] = False
+               Lm[n] = np.eye(self.T)
+      return wdelt,wB,Lm,V,ok
+
+   def margLogLikeBatch(self, thys):
+      """
+      Batched version of margLogLike. Returns a (N) ndarray 
+      of log-likelihoods (nan where Minv is not positive definite).
+      
+      Parameters
+      ----------
+      thys: (N,D,1+T) ndarray OR (N,D) ndarray if T=0
+         stack of theory prediction tables
+      """
+      if self.T == 0.:
+         return self.rawLogLikeBatch(thys)
+      
+      wdelt,wB,Lm,V,ok = self.anaCholBatch(thys)
+      LmV     = solveTriBatch(Lm,V)
+      chi2    = np.sum(wdelt**2,axis=1) - np.sum(LmV**2,axis=1)
+      logdetM = -np.sum(np.log(np.diagonal(Lm,axis1=1,axis2=2)),axis=1)
+      res     = -0.5*chi2 + logdetM*(not self.jeff)
+      res[~ok] = np.nan
+      return res
+
+   def getBestFitTempBatch(self, thys):
+      """
+      Batched version of getBestFitTemp. Returns a (N,T) ndarray.
+      
+      Parameters
+      ----------
+      thys: (N,D,1+T) ndarray
+         stack of theory prediction tables
+      """
+      _,_,Lm,V,ok = self.anaCholBatch(thys)
+      res = -1*solveTriBatch(Lm,solveTriBatch(Lm,V),trans=True)
+      res[~ok] = np.nan
+      return res
+
+   def rawLogLikeBatch(self, thys, tmp_prms=None):
+      """
+      Batched version of rawLogLike. Returns a (N) ndarray.
+      
+      Parameters
+      ----------
+      thys: (N,D,1+T) ndarray OR (N,D) ndarray if T=0
+         stack of theory prediction tables
+      tmp_prms : None OR (N,T) ndarray, default=None
+         values of the T template coefficients for each table
+
+      Raises
+      ------
+      RuntimeError
+         If tmp_prms isn't specified but the number of 
+         templates is > 0
+      """
+      if tmp_prms is None:
+         if self.T != 0.: 
+            s = "tmp_prms not specified, but the number"
+            s += " of templates is > 0"
+            raise RuntimeError(s)
+         full_thys = thys
+      else:
+         full_thys = thys[:,:,0] + np.einsum('ndt,nt->nd',thys[:,:,1:],tmp_prms)
+      wdelt = self.whiten(full_thys.T).T - self.wdat
+      res   = -0.5*np.sum(wdelt**2,axis=1)
+      if tmp_prms is not None:
+         delt = (tmp_prms - self.tmp_priors[:,0])/self.tmp_priors[:,1]
+         res -= 0.5*np.sum(delt**2,axis=1)
+         if self.jeff:
+            _,_,Lm,_,_ = self.anaCholBatch(thys)
+            res += np.sum(np.log(np.diagonal(Lm,axis1=1,axis2=2)),axis=1)
+      return res
+
+   def maxLogLikeBatch(self, thys):
+      """
+      Batched version of maxLogLike. Returns a (N) ndarray.
+      
+      Parameters
+      ----------
+      thys: (N,D,1+T) ndarray OR (N,D) ndarray if T=0
+         stack of theory prediction tables
+      """
+      if self.T == 0:
+         return self.rawLogLikeBatch(thys)
+      tmp_prms_star = self.getBestFitTempBatch(thys)
+      return self.rawLogLikeBatch(thys,tmp_prms=tmp_prms_star)
+
+   def margchi2Batch(self, thys):
+      """
+      Batched version of margchi2. Returns a (N) ndarray.
+      
+      Parameters
+      ----------
+      thys: (N,D,1+T) ndarray
+         stack of theory prediction tables
+      """
+      wdelt,wB,Lm,V,ok = self.anaCholBatch(thys)
+      # M = Minv^{-1} = Lm^{-T} Lm^{-1} and Y = M V from the Cholesky factor
+      Linv = solveTriBatch(Lm,np.broadcast_to(np.eye(self.T),Lm.shape))
+      M    = np.einsum('nki,nkj->nij',Linv,Linv)
+      Y    = solveTriBatch(Lm,solveTriBatch(Lm,V),trans=True)
+      X    = V + self.Vprior
+      # tr(Z W) with W = M + Y Y^T and Z = wB^T wB = Minv - CphiInv,
+      # where tr(Minv M) = T and Y^T Minv Y = Y^T V
+      chi2 = np.sum(wdelt**2,axis=1) - 2*np.sum(X*Y,axis=1)
+      chi2+= self.T - np.einsum('ij,nji->n',self.CphiInv,M)
+      chi2+= np.sum(Y*V,axis=1) - np.einsum('ni,ij,nj->n',Y,self.CphiInv,Y)
+      chi2[~ok] = np.nan
+      return chi2
+
    def get_random_tmp_prm(self, thy, Ndraw):
       """
-      Returns list (len = Ndraw) of linear ("template") paramaters 
+      Returns a (Ndraw,T) ndarray of linear ("template") paramaters 
       that are randomly drawn from the appropriate Gaussian
-      distribution
+      distribution, i.e. with mean -M V and covariance M
       
       Parameters
       ----------
@@ -243,19 +449,14 @@ class gaussLike():
          number of (Monte-Carlo) integration points
          used for the linear parameters
       """
-      delt,M,V = self.anaHelp(thy)
-      rescale  = np.diag(M)**0.5
-      def get_random_draw():
-         # rescaling the template parameters by their standard deviations
-         # improves the convergence of the Monte-Carlo integration
-         # (I think numpy isn't very good at making Gaussian draws when 
-         #  there is a large dynamic range in the Gaussian variables)
-         # I checked this by comparing the Monte-Carlo integration of the average chi2
-         # with the analytic calculation (margchi2)
-         return normal(-1.*np.dot(M,V)/rescale,M/np.outer(rescale,rescale))*rescale
-      return [get_random_draw() for i in range(Ndraw)]
+      _,_,Lm,V = self.anaChol(thy)
+      # Minv = Lm Lm^T, so x = Lm^{-T} z has covariance M for
+      # z drawn from a standard normal distribution
+      mean = -1*cho_solve((Lm,True),V)
+      z    = np.random.standard_normal((self.T,Ndraw))
+      return mean + solve_triangular(Lm,z,lower=True,trans='T',check_finite=False).T
         
-   def marg_chi2_pte(self, thy, Ndraw=100):
+   def marg_chi2_pte(self, thy, Ndraw=100, return_dist=False):
       """
       Returns the chi2 and PTE averaged over linear parameters (using MC integration).
       
@@ -266,11 +467,15 @@ class gaussLike():
       Ndraw: int
          number of (Monte-Carlo) integration points
          used for the linear parameters
+      return_dist: bool, default=False
+         If True, also returns the (Ndraw) ndarray of chi2's
+         (one for each draw of the linear parameters)
       """
       random_tmp_prms = self.get_random_tmp_prm(thy, Ndraw=Ndraw)
-      res = []
-      for tmp_prm in random_tmp_prms:
-         delt = np.dot(thy,np.array([1.]+list(tmp_prm))) - self.dat
-         chi2 = np.dot(np.dot(delt,self.cinv),delt)
-         res.append([chi2,pte(chi2,self.D)])
-      return np.mean(res,axis=0)
\ No newline at end of file
+      # whitened residuals for all draws, (D,Ndraw) ndarray
+      W     = self.whiten(thy)
+      wdelt = (W[:,0] - self.wdat)[:,None] + np.dot(W[:,1:],random_tmp_prms.T)
+      chi2s = np.sum(wdelt**2,axis=0)
+      res   = np.array([np.mean(chi2s),np.mean(pte(chi2s,self.D))])
+      if return_dist: return res,chi2s
+      return res
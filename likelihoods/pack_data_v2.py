@@ -1,6 +1,10 @@
 # This file constains several helper functions to 
 # nicely pack the (Cgg,Ckg) data and covariances given 
 # a set of scale cuts.
+#
+# The data can either be a dictionary (loaded from a .json file) 
+# or a DataStore (see spectra/datastore.py), whose arrays are
+# memory-mapped and only read from disk when needed.
 
 import numpy as np
 from scipy.interpolate import interp1d
@@ -74,7 +78,7 @@ def get_scale_cuts(data, amin, amax, xmin, xmax):
     
 def pack_cl_wl(data, kapNames, galNames, amin, amax, xmin, xmax):
     """
-    Packages data from .json file and returns
+    Packages data from .json file (or DataStore) and returns
     window functions and the data vector.
     
     If kapNames = [k1,k2,...,kn] and galNames = [g1,g2,...,gm] then the 
@@ -2,48 +2,63 @@
 import numpy as np
 import warnings
 import yaml
+from functools import lru_cache
 
 #from astropy.table        import Table, vstack, hstack
 #from sklearn.linear_model import LinearRegression
 
 
+class RandomsWeights():
+    """
+    The linear imaging-systematics weight model for one photo-z bin,
+    compiled from the coefficients file once: the intercepts and slopes
+    of both photometric systems are held as arrays, such that the weights
+    of a (chunk of) randoms are computed with a single matrix product,
+    without sub-selecting the table.
+    """
+    def __init__(self, weights_path, bin_index):
+        with open(weights_path, "r") as f:
+            linear_coeffs = yaml.safe_load(f)
+        self.xnames = list(linear_coeffs['south_bin_1'].keys())
+        self.xnames.remove('intercept')
+        # rows are the photometric systems (in self.photsys), with
+        # the first column being the intercept
+        self.photsys = ['N','S']
+        self.coeffs  = np.array([[linear_coeffs['{}_bin_{}'.format(field,bin_index)][xname] \
+                                  for xname in ['intercept']+self.xnames] for field in ['north','south']])
+
+    def __call__(self, randoms):
+        """
+        Returns the weights of randoms (an astropy Table or a dictionary
+        of columns), with zero weight for randoms with invalid imaging
+        properties or an unknown PHOTSYS.
+        """
+        data = np.column_stack([np.asarray(randoms[xname],dtype='f8') for xname in self.xnames])
+        mask_bad = ~np.all(np.isfinite(data),axis=1)
+        if np.sum(mask_bad)!=0:
+            print('{} invalid randoms'.format(np.sum(mask_bad)))
+        photsys = np.asarray(randoms['PHOTSYS'])
+        if photsys.dtype.kind=='S': photsys = np.char.decode(photsys)
+        # weights for both photometric systems at once, (Nrand,2)
+        data[mask_bad] = 0.
+        wts = self.coeffs[:,0] + np.dot(data,self.coeffs[:,1:].T)
+        weights = np.zeros(len(data))
+        for i,ps in enumerate(self.photsys):
+            mask = (photsys==ps)&(~mask_bad)
+            weights[mask] = wts[mask,i]
+        return(weights)
+
+
+@lru_cache(maxsize=None)
+def load_randoms_weights(weights_path, bin_index):
+    """
+    Returns the (cached) RandomsWeights for weights_path and bin_index.
+    """
+    return RandomsWeights(weights_path, bin_index)
+
+
 def get_randoms_weights(randoms, weights_path, bin_index):
-    with open(weights_path, "r") as f:
-        linear_coeffs = yaml.safe_load(f)
-    # Assign zero weights to randoms with invalid imaging properties
-    mask_bad = np.full(len(randoms), False)
-    xnames_fit = list(linear_coeffs['south_bin_1'].keys())
-    xnames_fit.remove('intercept')
-    for col in xnames_fit:
-        mask_bad |= ~np.isfinite(randoms[col])
-    if np.sum(mask_bad)!=0:
-        print('{} invalid randoms'.format(np.sum(mask_bad)))
-    #
-    weights = np.zeros(len(randoms))
-    #
-    for field in ['north','south']:
-        if field=='south':
-            photsys = 'S'
-        elif field=='north':
-            photsys = 'N'
-        #
-        mask  = randoms['PHOTSYS']==photsys
-        mask &= (~mask_bad)
-        data  = np.column_stack([randoms[mask][xname] for xname in xnames_fit])
-        #
-        bin_str = '{}_bin_{}'.format(field, bin_index)
-        #reg = LinearRegression()
-        #reg.intercept_ = linear_coeffs[bin_str]['intercept']
-        #reg.coef_ = np.array([linear_coeffs[bin_str][xname] for xname in xnames_fit])
-        #weights[mask] = reg.predict(data)
-        #
-        # Create array of coefficients, with the first coefficient being the intercept
-        coeffs = np.array([linear_coeffs[bin_str]['intercept']]+[linear_coeffs[bin_str][xname]\
-                 for xname in xnames_fit])
-        # create 2-D array of imaging properties, with the first columns being unity
-        data1 = np.insert(data, 0, 1., axis=1)
-        weights[mask] = np.dot(coeffs, data1.T)
-    return(weights)
+    return load_randoms_weights(weights_path, bin_index)(randoms)
 
 
 # Prepare the randoms
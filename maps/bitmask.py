@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+#
+# Compact storage of binary healpix masks, with one bit per pixel
+# (np.packbits) rather than an int32 or float64 per pixel. Masks are
+# combined with the bitwise operators directly on the packed bytes,
+# and only expanded to full-sky bool or float maps when needed.
+#
+# A MaskCube stores several named masks on the same grid in a single
+# memory-mapped (nmask,npix/8) uint8 .npy file (32x smaller per mask
+# than an int32 FITS map), with the names in a .json file next to it.
+import numpy as np
+import json
+import os
+
+
+class BitMask():
+    """
+    A binary healpix mask of npix pixels, stored as the packed bits
+    (big-endian, as in np.packbits) in mask.bits. Masks support
+    & (intersection), | (union), ^, ~ (complement) and - (a-b is a
+    and not b), e.g. north = ngc & dec_north.
+    """
+    def __init__(self,bits,npix):
+        self.bits = bits
+        self.npix = npix
+
+    @classmethod
+    def from_map(cls,m):
+        """
+        Returns the BitMask of the pixels where m is nonzero (True).
+        """
+        return cls(np.packbits(np.asarray(m)!=0),len(m))
+
+    def __and__(self,other):    return BitMask(self.bits & other.bits,self.npix)
+    def __or__(self,other):     return BitMask(self.bits | other.bits,self.npix)
+    def __xor__(self,other):    return BitMask(self.bits ^ other.bits,self.npix)
+    def __sub__(self,other):    return BitMask(self.bits & ~other.bits,self.npix)
+    def __invert__(self):       return BitMask(~self.bits,self.npix)
+
+    def bool(self):
+        """
+        Returns the full-sky mask as a (npix,) bool ndarray.
+        """
+        return np.unpackbits(self.bits,count=self.npix).astype(bool)
+
+    def float(self,dtype='f8'):
+        """
+        Returns the full-sky mask as a (npix,) ndarray of 0s and 1s.
+        """
+        return np.unpackbits(self.bits,count=self.npix).astype(dtype)
+
+    def sum(self):
+        """
+        Returns the number of unmasked (True) pixels.
+        """
+        return int(np.count_nonzero(np.unpackbits(self.bits,count=self.npix)))
+
+    def save(self,fn):
+        """
+        Saves the packed bits to the .npy file fn (by writing a
+        temporary file that is then renamed).
+        """
+        tmp = fn+'.tmp.npy'
+        np.save(tmp,np.asarray(self.bits))
+        os.replace(tmp,fn)
+
+    @classmethod
+    def load(cls,fn,mmap=True):
+        """
+        Loads a BitMask saved with save (memory-mapped if mmap). The
+        number of pixels is 8 bits per byte, which holds for all healpix
+        maps with nside>=2.
+        """
+        bits = np.load(fn,mmap_mode='r' if mmap else None)
+        return cls(bits,8*len(bits))
+
+
+def cube_meta_fname(fn):
+    """
+    Returns the name of the .json file with the names (and any
+    other metadata) of the MaskCube in the .npy file fn.
+    """
+    return os.path.splitext(fn)[0]+'.json'
+
+
+def write_mask_cube(fn,masks,**meta):
+    """
+    Writes the dictionary of masks (name -> BitMask, or healpix map
+    that is True where nonzero) to the MaskCube fn (a .npy file),
+    storing the names and meta (e.g. nside, coord) in the .json file
+    cube_meta_fname(fn). All masks must have the same number of pixels.
+    """
+    names = list(masks.keys())
+    bms   = [m if isinstance(m,BitMask) else BitMask.from_map(m) for m in masks.values()]
+    npix  = bms[0].npix
+    if any(bm.npix!=npix for bm in bms): raise ValueError('Masks have different npix')
+    tmp   = fn+'.tmp.npy'
+    np.save(tmp,np.array([bm.bits for bm in bms],dtype=np.uint8))
+    os.replace(tmp,fn)
+    with open(cube_meta_fname(fn),'w') as fout:
+        json.dump({'names':names,'npix':npix,**meta},fout,indent=2)
+
+
+class MaskCube():
+    """
+    A set of named binary masks read from a file written by
+    write_mask_cube. The bits are memory-mapped, such that only the
+    masks that are used are read, e.g.
+        cube = MaskCube('masks/aux_masks.npy')
+        msk  = lrg_mask*cube.mask('north')
+        msk  = lrg_mask*cube.mask('~DECm15')
+        bm   = cube.union('north','des')
+    where a name prefixed by ~ is the complement of that mask.
+    """
+    def __init__(self,fn):
+        with open(cube_meta_fname(fn),'r') as fin:
+            self.meta = json.load(fin)
+        self.names = self.meta['names']
+        self.npix  = self.meta['npix']
+        self.bits  = np.load(fn,mmap_mode='r')
+
+    def __contains__(self,name):
+        return name.lstrip('~') in self.names
+
+    def __getitem__(self,name):
+        """
+        Returns the BitMask name (or its complement for ~name).
+        """
+        neg  = name.startswith('~')
+        name = name.lstrip('~')
+        if name not in self.names: raise KeyError(f'No mask {name} in cube, have {self.names}')
+        bm   = BitMask(self.bits[self.names.index(name)],self.npix)
+        return ~bm if neg else bm
+
+    def intersection(self,*names):
+        """
+        Returns the BitMask of the pixels in all of the masks names.
+        """
+        res = self[names[0]]
+        for name in names[1:]: res = res & self[name]
+        return res
+
+    def union(self,*names):
+        """
+        Returns the BitMask of the pixels in any of the masks names.
+        """
+        res = self[names[0]]
+        for name in names[1:]: res = res | self[name]
+        return res
+
+    def mask(self,*names,dtype='f8'):
+        """
+        Returns the intersection of the masks names as a
+        full-sky (npix,) ndarray of 0s and 1s.
+        """
+        return self.intersection(*names).float(dtype)
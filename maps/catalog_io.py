@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+#
+# Streaming access to (large) FITS catalogs, used by the map makers
+# to bound the memory per rank by a chunk size rather than a file size.
+import numpy  as np
+from   astropy.io    import fits
+from   astropy.table import Table
+
+
+def read_chunks(fn,columns,chunk_size=4000000,ext=1,start=0,stop=None):
+    """
+    Iterates over the rows start:stop (default: all) of the FITS table in 
+    fn (HDU ext) in chunks of at most chunk_size rows, yielding an astropy
+    Table that only contains the requested columns. The file is memory-
+    mapped, such that only the bytes of these columns (and rows) are read
+    from disk. Compressed
+    (e.g. .fits.gz) files are decompressed by astropy in full, so this
+    is only worthwhile for small columns (e.g. the lrgmask files).
+    """
+    with fits.open(fn,memmap=True) as hdul:
+        data = hdul[ext].data
+        stop = len(data) if stop is None else min(stop,len(data))
+        for i in range(start,stop,chunk_size):
+            j    = min(i+chunk_size,stop)
+            cols = [np.array(data.field(col)[i:j]) for col in columns]
+            yield Table(cols,names=columns,copy=False)
+
+
+def row_ranges(fn,chunk_size,ext=1):
+    """
+    Splits the rows of the FITS table in fn (HDU ext) into a list
+    of (fn,start,stop) with at most chunk_size rows each, e.g. to
+    hand out a single large catalog to several ranks.
+    """
+    nrow = fits.getheader(fn,ext)['NAXIS2']
+    return [(fn,i,min(i+chunk_size,nrow)) for i in range(0,nrow,chunk_size)]
+
+
+def read_density(fn,ext=1):
+    """
+    Returns the number of randoms per sq.deg. stored in the
+    header of a randoms file, without reading the table.
+    """
+    return fits.getheader(fn,ext)['DENSITY']
@@ -3,136 +3,265 @@ import healpy as hp
 from   astropy.table import Table
 import urllib.request
 import os
+from   pixel_lookup import rotate_map,sky_coords
+from   bitmask      import BitMask,write_mask_cube
 
-def make_aux_masks(NSIDE_OUT=2048, COORD_OUT='c', outdir='masks', deccuts=[-15,-30], 
-                   ebvcuts=[0.05,0.1,0.15], starcuts=[2500,1500], verbose_sffx=False):
+# The Planck galactic masks (HFI_Mask_GalPlane) are fields 0-7 of the
+# file, for the following sky fractions [%].
+planck_gal_fsky = [20,40,60,70,80,90,97,99]
+
+
+def fetch_des_detection():
     """
-    Makes the following (binary) masks
-        ngc_mask.fits          | NGC 
-        sgc_mask.fits          | SGC 
-        north_mask.fits        | (DEC > 32.375) and NGC
-        des_mask.fits          | DES is defined as everywhere with positive "detection 
-                                 fraction" in any of the DES DR2 g,r,i,z,Y bands.
-        decals_mask.fits       | (not North) and (not DES) and (DEC > -15)
-        dec[P or M]#_mask.fits | creates a mask for each # [integer] in deccuts that 
-                                 is defined by DEC <= \PM #
-        ebv_#_mask.fits        | creates a mask for each # [float] in ebvcuts that is 
-                                 is defined by EBV <= #
-        gal#_mask.fits         | Planck 60% and 40% galactic masks
-        star_#_mask.fits       | creates a mask satisfying stellar-density<# for each
-                                 # in starcuts [stars per square degree]
-    at a given NSIDE_OUT and COORD_OUT system, and saves them to outdir/. If 
-    verbose_sffx=True, appends the string "_cord.{COORD_OUT}_nside.{NSIDE_OUT}" 
-    to the end of each mask name.
+    Returns the DES DR2 footprint at nside=4096 (in celestial coords) as a
+    BitMask, defined as everywhere with positive "detection fraction" in
+    any of the g,r,i,z,Y bands. The detection fraction files are fetched
+    from the web, and deleted once read.
     """
-    
-    if not os.path.exists(outdir): os.mkdir(outdir)
-    sffx = '' if (not verbose_sffx) else f'_cord.{COORD_OUT}_nside.{NSIDE_OUT}'
-
-    # Make DEC and RA in celestial coords and 
-    # rotate to COORD_OUT coords
-    npix      = 12*NSIDE_OUT**2
-    theta,phi = hp.pix2ang(NSIDE_OUT,np.arange(npix))
-    DEC_,RA_  = 90-np.degrees(theta),np.degrees(phi)
-    rot = hp.rotator.Rotator(coord=f'c{COORD_OUT}')
-    DEC = rot.rotate_map_pixel(DEC_)
-    RA  = rot.rotate_map_pixel(RA_)
-
-    ## Make NGC/SGC masks in galactic coords 
-    ## and rotate to COORD_OUT coords
-    ngc_mask = np.ones(npix) ; ngc_mask[np.where(DEC_<=0.)] = 0.
-    sgc_mask = np.ones(npix) ; sgc_mask[np.where(DEC_>0.)]  = 0.
-    rot      = hp.rotator.Rotator(coord=f'g{COORD_OUT}')
-    ngc_mask = np.round(rot.rotate_map_pixel(ngc_mask))
-    sgc_mask = np.round(rot.rotate_map_pixel(sgc_mask))
-    hp.write_map(f'{outdir}/ngc_mask{sffx}.fits',ngc_mask,overwrite=True,dtype=np.int32)
-    hp.write_map(f'{outdir}/sgc_mask{sffx}.fits',sgc_mask,overwrite=True,dtype=np.int32)
-
-    ## Make "North" mask in COORD_OUT coords
-    north_mask = ngc_mask.copy()
-    north_mask[np.where(DEC<=32.375)] = 0.
-    hp.write_map(f'{outdir}/north_mask{sffx}.fits',north_mask,overwrite=True,dtype=np.int32)
-
-    ## Make DES mask in COORD_OUT coords
     bands   = ['g','r','i','z','Y']
     website = 'https://desdr-server.ncsa.illinois.edu/despublic/dr2_tiles/Coverage_DR2/'
     fnames  = [f'dr2_hpix_4096_frac_detection_{b}.fits.fz' for b in bands]
-    # fetch detection fraction files from the web (HEALPix maps in celestial coords)
-    # and temporarily save them in the current directory  
-    for fn in fnames: urllib.request.urlretrieve(website+fn, fn)
-    maps = [hp.read_map(fn) for fn in fnames]
-    for i in range(len(maps)): maps[i][np.where(maps[i]<=0)]=0.
-    des_mask = hp.ud_grade(np.sum(maps,axis=0),NSIDE_OUT)
-    des_mask[np.where(des_mask>0.)]=1.
-    # rotate to COORD_OUT coordinates
-    rot = hp.rotator.Rotator(coord=f'c{COORD_OUT}')
-    des_mask = np.round(rot.rotate_map_pixel(des_mask))
-    hp.write_map(f'{outdir}/des_mask{sffx}.fits',des_mask,overwrite=True,dtype=np.int32)
-    # delete detection fraction files
-    for fn in fnames: os.remove(fn)
-
-    ## Make DECaLS mask in COORD_OUT coords
-    decals_mask = np.ones(npix) - north_mask - des_mask
-    decals_mask[np.where(DEC<=-15)] = 0.
-    hp.write_map(f'{outdir}/decals_mask{sffx}.fits',decals_mask,overwrite=True,dtype=np.int32)
-    
-    ## Make DEC <= DECcuts masks in COORD_OUT coords
-    for cut in np.array(deccuts,dtype=np.int32):
-        mask = np.ones(npix)
-        mask[np.where(DEC>cut)] = 0.
-        sgn = 'p' if cut>=0 else 'm'
-        hp.write_map(f'{outdir}/DEC{sgn}{np.abs(cut)}_mask{sffx}.fits',mask,overwrite=True,dtype=np.int32)
-        
-    ## Make EBV < X masks in COORD_OUT coords
-    version   = 0
-    colors    = 'rz'
-    nside     = 256
-    # fetch Rongpu's EBV map, which has nside=256 and is in celestial coords
+    det     = None
+    for fn in fnames:
+        urllib.request.urlretrieve(website+fn, fn)
+        m   = hp.read_map(fn)>0
+        det = m if det is None else det|m
+        os.remove(fn)
+    return BitMask.from_map(det)
+
+
+def fetch_ebv_sfd(version=0,colors='rz',nside=256):
+    """
+    Returns Rongpu's SFD EBV map (celestial coords, RING ordering).
+    """
     bd        = f'/global/cfs/cdirs/desicollab/users/rongpu/data/ebv/v{version}/kp3_maps/'
     ebv_table = Table.read(bd+f'v{version}_desi_ebv_{colors}_{nside}.fits')
-    rot       = hp.rotator.Rotator(coord=f'c{COORD_OUT}')
-    ebv_sfd   = rot.rotate_map_pixel(hp.ud_grade(ebv_table['EBV_SFD'],NSIDE_OUT))
-    for cut in np.array(ebvcuts):
-        mask = np.ones(npix)
-        mask[np.where(ebv_sfd>cut)] = 0.
-        hp.write_map(f'{outdir}/ebv_{cut:0.2f}_mask{sffx}.fits',mask,overwrite=True,dtype=np.int32)
-        
-    # Fetch 40% and 60% galactic masks from PLA  
+    return np.array(ebv_table['EBV_SFD'])
+
+
+def fetch_planck_gal():
+    """
+    Returns the (binary) Planck galactic masks in all fields of the
+    HFI_Mask_GalPlane file (nside=2048, galactic coords, see
+    planck_gal_fsky) as a (nfield,npix/8) ndarray of packed bits (see
+    BitMask). The file is fetched from the PLA once, and deleted.
+    """
     website = 'http://pla.esac.esa.int/pla/aio/product-action?MAP.MAP_ID='
     fname   = 'HFI_Mask_GalPlane-apo0_2048_R2.00.fits'
     urllib.request.urlretrieve(website+fname, fname)
-    # rotate from galactic to COORD_OUT coords
-    # and write to .fits files
-    msk40_gal = hp.read_map(fname,field=1)
-    msk60_gal = hp.read_map(fname,field=2)
-    rot       = hp.rotator.Rotator(coord=f'g{COORD_OUT}')
-    msk40     = np.round(rot.rotate_map_pixel(hp.ud_grade(msk40_gal,NSIDE_OUT)))
-    msk60     = np.round(rot.rotate_map_pixel(hp.ud_grade(msk60_gal,NSIDE_OUT)))
-    hp.write_map(f'{outdir}/gal40_mask{sffx}.fits',msk40,overwrite=True,dtype=np.int32)
-    hp.write_map(f'{outdir}/gal60_mask{sffx}.fits',msk60,overwrite=True,dtype=np.int32)
-    # delete the file from the web
+    bits    = np.array([BitMask.from_map(hp.read_map(fname,field=field)>0.5).bits \
+                        for field in range(len(planck_gal_fsky))])
     os.remove(fname)
-    
-    # Make stellar density masks
+    return bits
+
+
+def fetch_stardens(stars_nside=64):
+    """
+    Returns the stellar density (from the DR9 pixweight file) ud_graded
+    to stars_nside, in celestial coords and RING ordering.
+    """
     release   = 'dr9'
     version   = '1.0.0'
     db        = '/global/cfs/cdirs/desi/target/catalogs/'
     db       += release+'/'+version+'/pixweight/main/resolve/dark/'
-    fn        = db+'pixweight-1-dark.fits'
-    pxw_nside = 256
-    pxw_nest  = True
-    pxw       = Table.read(fn)
-    stars_nside = 64
-    stars     = hp.ud_grade(pxw['STARDENS'],stars_nside,order_in='NEST',order_out='RING')
-    theta,phi = hp.pix2ang(NSIDE_OUT,np.arange(12*NSIDE_OUT**2))
-    ipix      = hp.ang2pix(stars_nside,theta,phi)
-    rot       = hp.rotator.Rotator(coord=f'c{COORD_OUT}')
-    for cut in np.array(starcuts):
-        mask  = np.ones(12*NSIDE_OUT**2)
-        mask[stars[ipix]>cut] = 0.
-        mask  = np.round(rot.rotate_map_pixel(mask))
-        hp.write_map(f'{outdir}/star_{int(cut)}_mask{sffx}.fits',mask,overwrite=True,dtype=np.int32)
-    
+    pxw       = Table.read(db+'pixweight-1-dark.fits')
+    return hp.ud_grade(pxw['STARDENS'],stars_nside,order_in='NEST',order_out='RING')
+
+
+def mask_label(name,cut=None):
+    """
+    Returns the label of mask (name,cut), as used in the file names,
+    e.g. ('ngc',None) -> 'ngc', ('dec',-15) -> 'DECm15', ('ebv',0.1)
+    -> 'ebv_0.10', ('gal',40) -> 'gal40' and ('star',2500) -> 'star_2500'.
+    """
+    if name=='dec':
+        sgn = 'p' if cut>=0 else 'm'
+        return f'DEC{sgn}{np.abs(int(cut))}'
+    if name=='ebv':  return f'ebv_{cut:0.2f}'
+    if name=='gal':  return f'gal{int(cut)}'
+    if name=='star': return f'star_{int(cut)}'
+    return name
+
+
+def cache_label(name,cut=None):
+    """
+    Returns the label of mask (name,cut) in the AuxMasks cache, which
+    (unlike mask_label) keeps the exact value of cut, e.g. ('ebv',0.125)
+    -> 'ebv_0.125' and ('dec',-15) -> 'dec_-15.0'.
+    """
+    if cut is None: return name
+    return f'{name}_{float(cut)!r}'
+
+
+class AuxMasks():
+    """
+    A registry of the auxiliary (binary) masks at a given nside and coord
+    system, e.g.
+        am     = AuxMasks(2048,'c')
+        north  = am('north')
+        lowebv = am('ebv',0.05) & ~am('des')
+    Each mask is built on demand and kept as a BitMask, both in memory
+    and in cache_dir, keyed by (name,cut,nside,coord). The (native-
+    resolution) inputs that are fetched from the web or NERSC are also
+    cached in cache_dir, so e.g. a new EBV threshold only costs a gather
+    and a comparison. The masks are:
+        ngc          | NGC
+        sgc          | SGC
+        north        | (DEC > 32.375) and NGC
+        des          | DES is defined as everywhere with positive "detection
+                       fraction" in any of the DES DR2 g,r,i,z,Y bands.
+        decals       | (not North) and (not DES) and (DEC > -15)
+        dec,cut      | DEC <= cut
+        ebv,cut      | EBV <= cut
+        gal,cut      | Planck galactic mask with fsky=cut [%], see planck_gal_fsky
+        star,cut     | stellar-density <= cut [stars per square degree]
+    """
+    def __init__(self,nside=2048,coord='c',cache_dir='masks/cache'):
+        self.nside     = nside
+        self.coord     = coord
+        self.cache_dir = cache_dir
+        self.masks     = {}
+        self.inputs    = {}
+        self.coords    = {}
+        self.builders  = {'ngc':self.build_ngc,'sgc':self.build_sgc,'north':self.build_north,\
+                          'des':self.build_des,'decals':self.build_decals,'dec':self.build_dec,\
+                          'ebv':self.build_ebv,'gal':self.build_gal,'star':self.build_star}
+
+    def __call__(self,name,cut=None):
+        """
+        Returns the BitMask (name,cut), building it if it is not cached.
+        """
+        key = (name,cut)
+        if key not in self.masks:
+            if name not in self.builders: raise ValueError(f'Unknown mask {name}')
+            fn = os.path.join(self.cache_dir,f'{cache_label(name,cut)}_{self.coord}{self.nside}.npy')
+            if os.path.exists(fn):
+                self.masks[key] = BitMask.load(fn)
+            else:
+                self.masks[key] = self.builders[name](cut)
+                os.makedirs(self.cache_dir,exist_ok=True)
+                self.masks[key].save(fn)
+        return self.masks[key]
+
+    def input(self,name,fetch):
+        """
+        Returns the input map name, loading it from cache_dir if it
+        exists and otherwise calling fetch() and caching the result.
+        BitMask inputs are stored with their packed bits.
+        """
+        if name not in self.inputs:
+            fn = os.path.join(self.cache_dir,'inputs',name+'.npy')
+            if os.path.exists(fn):
+                self.inputs[name] = np.load(fn,mmap_mode='r')
+            else:
+                m  = fetch()
+                os.makedirs(os.path.dirname(fn),exist_ok=True)
+                np.save(fn+'.tmp.npy',m.bits if isinstance(m,BitMask) else m)
+                os.replace(fn+'.tmp.npy',fn)
+                self.inputs[name] = m.bits if isinstance(m,BitMask) else m
+        return self.inputs[name]
+
+    def latitude(self,coord):
+        """
+        Returns the latitude [deg] in coord coordinates (e.g. DEC for 'c',
+        galactic latitude for 'g') of the centers of the pixels.
+        """
+        if coord not in self.coords:
+            self.coords[coord],_ = sky_coords(self.nside,self.coord,coord=coord)
+        return self.coords[coord]
+
+    def build_ngc(self,cut=None):
+        return BitMask.from_map(self.latitude('g')>0.)
+
+    def build_sgc(self,cut=None):
+        return ~self('ngc')
+
+    def build_north(self,cut=None):
+        return self('ngc') & BitMask.from_map(self.latitude('c')>32.375)
+
+    def build_des(self,cut=None):
+        bits = self.input('des_detection_4096',fetch_des_detection)
+        det  = BitMask(bits,8*len(bits)).float()
+        # any detection within the (nside,celestial) pixels,
+        # rotated to coord coordinates
+        des  = hp.ud_grade(det,self.nside)>0.
+        return BitMask.from_map(rotate_map(des,'c',self.coord))
+
+    def build_decals(self,cut=None):
+        return ~self('north') - self('des') - self('dec',-15)
+
+    def build_dec(self,cut):
+        return BitMask.from_map(self.latitude('c')<=cut)
+
+    def build_ebv(self,cut):
+        ebv = self.input('ebv_sfd_256',fetch_ebv_sfd)
+        return BitMask.from_map(rotate_map(ebv,'c',self.coord,nside_out=self.nside)<=cut)
+
+    def build_gal(self,cut):
+        bits = self.input('planck_gal_2048',fetch_planck_gal)
+        msk  = BitMask(bits[planck_gal_fsky.index(int(cut))],12*2048**2).float()
+        return BitMask.from_map(rotate_map(msk,'g',self.coord,nside_out=self.nside)>0.5)
+
+    def build_star(self,cut):
+        stars = self.input('stardens_64',fetch_stardens)
+        return BitMask.from_map(rotate_map(stars,'c',self.coord,nside_out=self.nside)<=cut)
+
+    def write(self,name,cut=None,outdir='masks',sffx=''):
+        """
+        Writes the mask (name,cut) to outdir/{label}_mask{sffx}.fits
+        (as an int32 healpix map, see mask_label).
+        """
+        fn = f'{outdir}/{mask_label(name,cut)}_mask{sffx}.fits'
+        hp.write_map(fn,self(name,cut).float(),overwrite=True,dtype=np.int32)
+
+    def write_cube(self,fn,keys):
+        """
+        Writes the masks keys = [(name,cut),...] to the bit-packed
+        MaskCube fn (see bitmask.py), named by their mask_label.
+        """
+        masks = {mask_label(name,cut):self(name,cut) for name,cut in keys}
+        write_mask_cube(fn,masks,nside=self.nside,coord=self.coord)
+
+
+def make_aux_masks(NSIDE_OUT=2048, COORD_OUT='c', outdir='masks', deccuts=[-15,-30],
+                   ebvcuts=[0.05,0.1,0.15], starcuts=[2500,1500], galcuts=[40,60],
+                   verbose_sffx=False, cache_dir=None):
+    """
+    Makes the following (binary) masks
+        ngc_mask.fits          | NGC
+        sgc_mask.fits          | SGC
+        north_mask.fits        | (DEC > 32.375) and NGC
+        des_mask.fits          | DES is defined as everywhere with positive "detection
+                                 fraction" in any of the DES DR2 g,r,i,z,Y bands.
+        decals_mask.fits       | (not North) and (not DES) and (DEC > -15)
+        dec[P or M]#_mask.fits | creates a mask for each # [integer] in deccuts that
+                                 is defined by DEC <= \PM #
+        ebv_#_mask.fits        | creates a mask for each # [float] in ebvcuts that is
+                                 is defined by EBV <= #
+        gal#_mask.fits         | Planck galactic masks for each # [%] in galcuts
+        star_#_mask.fits       | creates a mask satisfying stellar-density<# for each
+                                 # in starcuts [stars per square degree]
+    at a given NSIDE_OUT and COORD_OUT system, and saves them to outdir/. If
+    verbose_sffx=True, appends the string "_cord.{COORD_OUT}_nside.{NSIDE_OUT}"
+    to the end of each mask name. All of the masks are also written to the 
+    bit-packed MaskCube outdir/aux_masks.npy (see bitmask.py), with the 
+    names above (e.g. 'north', 'DECm15'). The masks (and their inputs) are built with
+    (and cached by) AuxMasks, in cache_dir (default: outdir/cache), such that
+    rerunning with e.g. new cuts only builds the new masks.
+    """
+
+    if not os.path.exists(outdir): os.mkdir(outdir)
+    sffx = '' if (not verbose_sffx) else f'_cord.{COORD_OUT}_nside.{NSIDE_OUT}'
+    if cache_dir is None: cache_dir = f'{outdir}/cache'
+    am   = AuxMasks(NSIDE_OUT,COORD_OUT,cache_dir)
+    keys = [(name,None) for name in ['ngc','sgc','north','des','decals']]
+    keys+= [('dec', int(cut))   for cut in deccuts]
+    keys+= [('ebv', float(cut)) for cut in ebvcuts]
+    keys+= [('gal', int(cut))   for cut in galcuts]
+    keys+= [('star',float(cut)) for cut in starcuts]
+    for name,cut in keys: am.write(name,cut,outdir=outdir,sffx=sffx)
+    # and all of them (one bit per mask per pixel) in a single file
+    am.write_cube(f'{outdir}/aux_masks{sffx}.npy',keys)
 
 if __name__ == "__main__":
     import sys
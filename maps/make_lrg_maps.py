@@ -9,19 +9,34 @@ import healpy as hp
 import glob
 import sys
 from   astropy.table import Table
-from assign_randoms_weights import get_randoms_weights
+from assign_randoms_weights import RandomsWeights
+from catalog_io import read_chunks,read_density,row_ranges
+from pixel_counts import SparseMap,sparse_counts,reduce_sparse,write_sky_map
+from work_queue import work_queue,pool_sum,get_comm
+from pixel_lookup import pixel_lookup
+from functools import partial
+from itertools import zip_longest
 import sys
 sys.path.append('../')
 from globe import NSIDE,COORD
 
+# Only these columns are read from the galaxy and randoms files.
+gal_columns = ['RA','DEC','pz_bin','lrg_mask','EBV',\
+               'PIXEL_NOBS_G','PIXEL_NOBS_R','PIXEL_NOBS_Z']
+ran_columns = ['RA','DEC','NOBS_G','NOBS_R','NOBS_Z','EBV','PHOTSYS',\
+               'GALDEPTH_G','GALDEPTH_R','GALDEPTH_Z','PSFDEPTH_W1','PSFDEPTH_W2',\
+               'PSFSIZE_G','PSFSIZE_R','PSFSIZE_Z']
+
 bdir = '/global/cfs/cdirs/desi/users/rongpu/data/lrg_xcorr/imaging_weights/main_lrg/'
 fiducial_weights_path = bdir+'main_lrg_linear_coeffs_pz.yaml'
 noebv_weights_path    = bdir+'main_lrg_linear_coeffs_pz_no_ebv.yaml'
 
-from mpi4py import MPI
-comm = MPI.COMM_WORLD
-rank = comm.Get_rank()
-nproc= comm.Get_size()
+# The stellar density map (from the pixweight file) is in Celestial
+# coordinates and NEST ordering, and is ud_graded to stars_nside.
+# The output maps are in RING ordering (isnest=False).
+stars_nside = 64
+pxw_nest    = True
+isnest      = False
 
 def toMag(depth,ext,ebv):
     """A 'safe' conversion of depth to magnitude."""
@@ -29,27 +44,243 @@ def toMag(depth,ext,ebv):
     mag= -2.5*(np.log10(5/dd)-9) - ext*ebv
     return(mag)
 
-def make_lrg_map(isamp,ebv_cut=0.15,star_cut=2500.,weights_path=None):
+def sample_selection(pz,isamp):
+    """
+    Returns the selection of sample isamp given the photo-z bins pz:
+    isamp==0 is the whole sample (pz_bin 1-4), otherwise pz_bin==isamp%10.
+    """
+    if isamp==0: return (pz>0)&(pz<5)
+    return pz==isamp%10
+
+
+def pixelize(ra,dec,rot_nside=None):
+    """
+    Returns the pixels of the stellar density map (stars_nside, Celestial,
+    NEST) and of the output maps (NSIDE, COORD, isnest) that contain the
+    objects at ra,dec (in degrees), from a single conversion to angles.
+    If rot_nside is None the C->COORD rotation is done per object (exact),
+    otherwise each object is assigned to the NEST pixel at rot_nside that
+    contains it, and the rotation is replaced by a gather with a cached
+    lookup table (see pixel_lookup.py), such that the output pixel is
+    that of the center of the rot_nside pixel. rot_nside must be a power
+    of two that is >=stars_nside, and should be a few times NSIDE (the
+    table holds 12*rot_nside**2 int32's, memory-mapped from disk).
+    """
+    theta,phi = np.radians(90-dec),np.radians(ra)
+    if rot_nside is None:
+        spix      = hp.ang2pix(stars_nside,theta,phi,nest=pxw_nest)
+        theta,phi = hp.rotator.Rotator(coord=['c',COORD])(theta,phi)
+        return spix,hp.ang2pix(NSIDE,theta,phi,nest=isnest)
+    pc   = hp.ang2pix(rot_nside,theta,phi,nest=True)
+    # The NEST parent of pc at stars_nside.
+    spix = pc >> (2*int(np.log2(rot_nside//stars_nside)))
+    if not pxw_nest: spix = hp.nest2ring(stars_nside,spix)
+    return spix,pixel_lookup(rot_nside,'c',NSIDE,COORD,nest1=True,nest2=isnest)[pc]
+
+
+def galaxy_counts(rows,isamps,stars,ebv_cut=0.15,star_cut=2500.,chunk_size=4000000,rot_nside=None):
+    """
+    Returns a SparseMap with the number of selected galaxies of each 
+    sample in isamps (vals[i] for isamps[i]) from rows = (catalog file,
+    start, stop) in each pixel of the (NSIDE,COORD) map. The cuts that
+    are common to all samples, the rotation and the pixelization are
+    only done once per object (see pixelize for rot_nside).
+    """
+    fn,start,stop = rows
+    dmap   = SparseMap(nval=len(isamps))
+    # Stream through the file, only reading the columns we need
+    # and combining all of the cuts into a single selection.
+    for tt in read_chunks(fn,gal_columns,chunk_size,start=start,stop=stop):
+        # First select the (union of the) samples.
+        sel = np.zeros(len(tt),dtype=bool)
+        for isamp in isamps: sel|= sample_selection(tt['pz_bin'],isamp)
+        sel&= tt['lrg_mask']==0
+        # Restrict to the "observed" area.
+        sel&= (tt['PIXEL_NOBS_G']>1)&(tt['PIXEL_NOBS_R']>1)&\
+              (tt['PIXEL_NOBS_Z']>1)
+        # Cut out regions of "high" extinction.
+        sel&= (tt['EBV']<ebv_cut)
+        idx = np.nonzero(sel)[0]
+        # Apply any other cuts we want here, e.g. on stellar density.
+        spix,pixnum = pixelize(tt['RA'][idx],tt['DEC'][idx],rot_nside)
+        sdens     = stars[spix]
+        keep      = sdens<star_cut
+        pixnum,idx= pixnum[keep],idx[keep]
+        # accumulate the partial maps of all samples:
+        if len(idx)>0:
+            insamp    = np.array([sample_selection(tt['pz_bin'][idx],isamp) for isamp in isamps],dtype='f8')
+            dmap      = dmap + sparse_counts(pixnum,insamp,counts=False)
+    return dmap
+
+
+def randoms_counts(files,stars,ebv_cut=0.15,star_cut=2500.,weight_models=[None],chunk_size=4000000,\
+                   rot_nside=None):
+    """
+    Returns a SparseMap with the number of selected randoms (vals[0]),
+    and the sum of their imaging weights for each of weight_models 
+    (vals[1:]), in each pixel of the (NSIDE,COORD) map, for files = 
+    (randoms file, row-matched lrgmask file). The weight models are 
+    RandomsWeights, or None for unit weights. The objects are only
+    pixelized once (see pixelize for rot_nside).
+    """
+    fn,mf = files
+    rmap  = SparseMap(nval=1+len(weight_models))
+    # Stream through the randoms and their (row-matched)
+    # lrg_mask file together.
+    for tt,mm in zip_longest(read_chunks(fn,ran_columns,chunk_size),\
+                             read_chunks(mf,['lrg_mask'],chunk_size)):
+        if (tt is None) or (mm is None) or (len(tt)!=len(mm)):
+            raise ValueError(f'{fn} and {mf} have different numbers of rows')
+        # Restrict to the "observed" area.
+        sel = (tt['NOBS_G']>1)&(tt['NOBS_R']>1)&(tt['NOBS_Z']>1)
+        # Cut out regions of "high" extinction.
+        sel&= (tt['EBV']<ebv_cut)
+        # and select LRG objects.
+        sel&= mm['lrg_mask']==0
+        # Throw away the little islands below the NGC.
+        ra,dec = tt['RA'],tt['DEC']
+        sel&=~((ra>135)&(ra<170)&(dec<-10.5)&(dec>-31))
+        sel&=~((ra>215)&(ra<225)&(dec<-10.5)&(dec>-20))
+        # Apply any other cuts we want here, e.g. on stellar density.
+        idx       = np.nonzero(sel)[0]
+        spix,pixnum = pixelize(ra[idx],dec[idx],rot_nside)
+        keep      = stars[spix]<star_cut
+        tt,pixnum = tt[idx[keep]],pixnum[keep]
+        # Now weight the randoms (or not).
+        if any(wm is not None for wm in weight_models):
+            # Random weights want these fields.
+            tt['galdepth_gmag_ebv'] = toMag(tt['GALDEPTH_G' ],3.214,tt['EBV'])
+            tt['galdepth_rmag_ebv'] = toMag(tt['GALDEPTH_R' ],2.165,tt['EBV'])
+            tt['galdepth_zmag_ebv'] = toMag(tt['GALDEPTH_Z' ],1.211,tt['EBV'])
+            tt['psfdepth_w1mag_ebv']= toMag(tt['PSFDEPTH_W1'],0.184,tt['EBV'])
+            tt['psfdepth_w2mag_ebv']= toMag(tt['PSFDEPTH_W2'],0.113,tt['EBV'])
+        wt = np.array([np.ones(len(tt)) if wm is None else wm(tt) for wm in weight_models])
+        #
+        # Now bin the randoms into the map (pixnum is already
+        # in COORD coordinates).
+        # Produce weighted and unweighted maps (in one go).
+        rmap = rmap + sparse_counts(pixnum,wt)
+    return rmap
+
+
+def write_lrg_map(isamp,dmap,rmap,wtot,flog,partial_sky=False):
+    """
+    Given the full-sky galaxy counts (dmap), weighted (rmap) and
+    unweighted (wtot) randoms counts of sample isamp, makes the mask 
+    and overdensity map, logs some summary statistics to flog and 
+    writes the maps (only within the footprint if partial_sky, see 
+    pixel_counts.read_sky_map).
+    """
+    nside = NSIDE
+    npix  = 12*nside**2
+    wmap  = rmap/(wtot+1e-30)
+    #
+    # Compute the average number of randoms per pixel.
+    msk  = np.nonzero(rmap>0)[0]
+    avg  = np.mean(rmap[msk])
+    #
+    # Set the mask to be regions with >=1/5 of the average,
+    # i.e. this is an "inclusion mask".
+    # We allow relatively large corrections to make sure we don't
+    # have lots of small holes that give ringing.
+    msk  = np.nonzero(rmap>0.20*avg)[0]
+    #
+    print("Have {:e} total galaxies in masked region.".format(np.sum(dmap[msk])))
+    print("Have {:8.2f} galaxies per masked pixel.".format(np.mean(dmap[msk])))
+    print("Have {:8.2f} randoms  per masked pixel.".format(np.mean(wtot[msk])))
+    flog.write("Have {:e} total galaxies in masked region.\n".format(np.sum(dmap[msk])))
+    flog.write("Have {:8.2f} galaxies per masked pixel.\n".format(np.mean(dmap[msk])))
+    flog.write("Have {:8.2f} randoms  per masked pixel.\n".format(np.mean(wtot[msk])))
+    # Now fill in the masked region.
+    omap      = np.zeros(npix,dtype='f8')
+    omap[msk] = dmap[msk]/rmap[msk]
+    omap[msk] = omap[msk]/np.mean(omap[msk]) - 1
+    omap      = omap.astype('f4')   # Don't need full precision.
+    mask      = np.zeros(npix,dtype='f4')
+    mask[msk] = 1.0
+    # Print some useful numbers.
+    shot = np.sum(dmap[msk]/wmap[msk])**2/np.sum(dmap[msk]/wmap[msk]**2)
+    shot = np.sum(mask)*hp.nside2pixarea(nside,False)/shot
+    ninv = np.sum(mask)*hp.nside2pixarea(nside,False)/np.sum(dmap[msk])
+    nbar = 1.0/ninv * (np.pi/180.)**2 # Per sq.deg.
+    print("Mean of omap is {:e}.".format(np.mean(omap)))
+    print("nbar         is {:f}/deg2".format(nbar))
+    print("1/nbar       is {:e}".format(ninv))
+    print("Shot noise   is {:e}".format(shot))
+    print("Sky fraction is {:f}.".format(np.sum(mask)/mask.size))
+    #
+    flog.write("Mean of omap is {:e}.\n".format(np.mean(omap)))
+    flog.write("nbar         is {:f}/deg2\n".format(nbar))
+    flog.write("1/nbar       is {:e}\n".format(ninv))
+    flog.write("Shot noise   is {:e}\n".format(shot))
+    flog.write("Sky fraction is {:f}\n".format(np.sum(mask)/mask.size))
+    # Write the basic maps we always want.
+    for outnside in [NSIDE]:
+        pref = "lrg_s{:02d}".format(isamp)
+        hpex = ".hpx{:04d}_nowghts.fits".format(outnside)
+        mmap = hp.ud_grade(mask,outnside)
+        foot = np.nonzero(mmap>0)[0]
+        nmap = hp.ud_grade(omap,outnside)
+        write_sky_map(pref+"_del"+hpex,nmap,foot,partial=partial_sky,dtype='f4',\
+                 nest=isnest,coord='G',overwrite=True)
+        write_sky_map(pref+"_msk"+hpex,mmap,foot,partial=partial_sky,dtype='f4',\
+                 nest=isnest,coord='G',overwrite=True)
+
+
+class MultiLog():
+    """
+    Writes the same messages to the log files of several samples.
+    """
+    def __init__(self,flogs): self.flogs = flogs
+    def write(self,msg):
+        for flog in self.flogs: flog.write(msg)
+    def flush(self):
+        for flog in self.flogs: flog.flush()
+
+
+def make_lrg_maps(isamps,ebv_cut=0.15,star_cut=2500.,weights_path=None,chunk_size=4000000,\
+                  max_rand_files=None,nworkers=1,partial_sky=False,rot_nside=None):
+    """
+    Makes the density maps and masks of all samples in isamps (e.g.
+    [0,1,2,3,4]) from a single pass over the galaxy, randoms and lrgmask
+    files, since the samples only differ in their pz_bin selection and 
+    weight coefficients. The galaxy catalog (in row ranges of chunk_size)
+    and the randoms files are handed out dynamically (see work_queue.py):
+    under MPI rank 0 distributes the work while the other ranks do it, 
+    while nworkers>1 runs on a single node with a process pool instead
+    (without MPI, which is then not imported). 
+    All randoms files are used unless max_rand_files is given. The 
+    partial maps are accumulated and reduced sparsely (see pixel_counts.py),
+    and if partial_sky the output maps are only written within the footprint.
+    If rot_nside is given, objects are rotated to COORD with a cached
+    pixel lookup table at that resolution (see pixelize).
+    """
+    # MPI is only initialized if we are not forking a process pool.
+    comm  = get_comm(mpi=(nworkers==1))
+    rank  = comm.Get_rank()
+    nproc = comm.Get_size()
     # Set up the pz_bin based on isamp.
-    pz_bin = isamp%10
-    # Write a log file, to get around annoying buffering issues
-    # at NERSC.
+    pz_bins = [isamp%10 for isamp in isamps]
+    # Write a log file (per sample), to get around annoying 
+    # buffering issues at NERSC.
     if rank==0:
-        flog = open("make_lrg_maps_s{:02d}.log".format(isamp),"w")
+        flogs = [open("make_lrg_maps_s{:02d}.log".format(isamp),"w") for isamp in isamps]
+        flog  = MultiLog(flogs)
         flog.write("Running "+sys.argv[0]+" on "+str(nproc)+" ranks.\n")
-        flog.write("Generating sample "+str(isamp)+"\n")
-        flog.write("Setting pz_bin to "+str(pz_bin)+"\n")
+        for isamp,pz_bin,fl in zip(isamps,pz_bins,flogs):
+            fl.write("Generating sample "+str(isamp)+"\n")
+            fl.write("Setting pz_bin to "+str(pz_bin)+"\n")
+        if len(isamps)>1:
+            flog.write("Generating samples "+str(isamps)+" in a single pass\n")
     # We will make the maps with a different resolution and ordering than
     # HPXPIXEL that is already provided (typically NSIDE=64, NEST=True).
     # Typically we make the systematics maps with lower nside than we
     # want the final maps to be, so put a flag for writing systmaps.
     nside = NSIDE
     npix  = 12*nside**2
-    isnest= False
     if rank==0:
         flog.write("Will write {:d} pixels (Nside={:d}).\n".format(npix,nside))
         flog.write("Format isnest="+str(isnest)+"\n\n")
-    rot = hp.rotator.Rotator(coord=['c',COORD])
     # Set up the data release and version info we'll use.
     release = 'dr9'
     version = '1.0.0'
@@ -60,7 +291,6 @@ def make_lrg_map(isamp,ebv_cut=0.15,star_cut=2500.,weights_path=None):
     db += release+'/'+version+'/pixweight/main/resolve/dark/'
     fn  = db+'pixweight-1-dark.fits'
     pxw_nside = 256
-    pxw_nest  = True
     # Want to only read this once if possible.
     if rank==0:
         flog.write("Pix-weight file: "+fn+"\n")
@@ -70,7 +300,6 @@ def make_lrg_map(isamp,ebv_cut=0.15,star_cut=2500.,weights_path=None):
     pxw = comm.bcast(pxw,root=0)
     # Downgrade the stellar density map to remove the many holes
     # and islands that exist at Nside=256.
-    stars_nside = 64
     stars = hp.ud_grade(pxw['STARDENS'],stars_nside,\
                         order_in='NEST',order_out='NEST')
     # Start with the data.
@@ -79,53 +308,41 @@ def make_lrg_map(isamp,ebv_cut=0.15,star_cut=2500.,weights_path=None):
     if rank==0:
         flog.write("Cutting on E(B-V)<{:f}\n".format(ebv_cut))
         flog.write("Cutting on STARDENS<{:f}\n".format(star_cut))
-        flog.write("Star map ud_graded to Nside={:d}\n\n".format(stars_nside))
+        flog.write("Star map ud_graded to Nside={:d}\n".format(stars_nside))
+        if rot_nside is not None:
+            flog.write("Rotating with a lookup table at Nside={:d}\n".format(rot_nside))
+        flog.write("\n")
         flog.write("Data file path: "+db+"\n")
         flog.write("Data file name: "+fn+"\n")
         flist = glob.glob(db+fn)
         flist = sorted(flist)
         flog.write("Will read {:d} data files...\n".format(len(flist)))
         flog.flush()
+        # Split the catalog(s) into row ranges that can be handed out.
+        rows  = [r for fn in flist for r in row_ranges(fn,chunk_size)]
     else:
-        flist = None
-    flist = comm.bcast(flist,root=0)
+        rows  = None
+    rows = comm.bcast(rows,root=0)
     #
-    dmap = np.zeros(npix,dtype='f8')
-    for i,fn in enumerate(flist):
-      if i%nproc==rank:
-        tt = Table.read(fn)
-        # First select the sample.
-        if isamp==0:  # isamp==0 is the whole sample
-            tt = tt[ (tt['pz_bin']>0)&(tt['pz_bin']<5) ]
-        else:
-            tt = tt[ tt['pz_bin']==pz_bin ]
-        tt = tt[ tt['lrg_mask']==0 ]
-        # Restrict to the "observed" area.
-        tt = tt[(tt['PIXEL_NOBS_G']>1)&(tt['PIXEL_NOBS_R']>1)&\
-                (tt['PIXEL_NOBS_Z']>1)]
-        # Cut out regions of "high" extinction.
-        tt = tt[(tt['EBV']<ebv_cut)]
-        # Apply any other cuts we want here, e.g. on stellar density.
-        theta,phi = np.radians(90-tt['DEC']),np.radians(tt['RA'])
-        pixnum    = hp.ang2pix(stars_nside,theta,phi,nest=pxw_nest)
-        sdens     = stars[pixnum]
-        tt        = tt[sdens<star_cut]
-        # generate the partial map:
-        if len(tt)>0:
-            theta,phi = np.radians(90-tt['DEC']),np.radians(tt['RA'])
-            theta,phi = rot(theta,phi) # C->COORD coordinates
-            pixnum    = hp.ang2pix(nside,theta,phi,nest=isnest)
-            tmp, _    = np.histogram(pixnum,bins=np.arange(npix+1)-0.5)
-            dmap     += tmp
-    dtot = np.zeros(npix,dtype='f8')
-    comm.Reduce(dmap,dtot,op=MPI.SUM,root=0)
-    dmap = dtot
+    # Hand out the row ranges to the ranks (or processes) as they free up.
+    gal_func = partial(galaxy_counts,isamps=isamps,stars=stars,ebv_cut=ebv_cut,\
+                       star_cut=star_cut,chunk_size=chunk_size,rot_nside=rot_nside)
+    # The partial maps are sparse, so that only the occupied pixels 
+    # are accumulated and communicated.
+    if nworkers>1:
+        dmaps = pool_sum(gal_func,rows,nworkers,start=SparseMap(nval=len(isamps)))
+    else:
+        dmaps = SparseMap(nval=len(isamps))
+        for i in work_queue(len(rows),comm): dmaps = dmaps + gal_func(rows[i])
+        dmaps = reduce_sparse(dmaps,comm,root=0)
+    if rank==0: dmaps = dmaps.dense(npix)
     # Print some summary statistics.
     if rank==0:
-        msk = np.nonzero(dmap>0)[0]
-        flog.write("Read and assigned {:e} galaxies.\n".format(np.sum(dmap)))
-        flog.write("Have {:d} non-empty pixels, covering {:f} sq.deg.\n".\
-           format(len(msk),len(msk)*hp.nside2pixarea(nside,True)))
+        for dmap,fl in zip(dmaps,flogs):
+            msk = np.nonzero(dmap>0)[0]
+            fl.write("Read and assigned {:e} galaxies.\n".format(np.sum(dmap)))
+            fl.write("Have {:d} non-empty pixels, covering {:f} sq.deg.\n".\
+               format(len(msk),len(msk)*hp.nside2pixarea(nside,True)))
         flog.write("Done with galaxy files.\n\n")
         flog.flush()
     #
@@ -142,8 +359,8 @@ def make_lrg_map(isamp,ebv_cut=0.15,star_cut=2500.,weights_path=None):
         flist = glob.glob(rb+r'randoms-[0-9]-[0-9].fits')
         flist+= glob.glob(rb+r'randoms-[0-9]-1[0-9].fits')
         flist = sorted(flist)
-        if len(flist)>nproc:
-            flist = flist[:nproc]   # Otherwise it takes too long!
+        if (max_rand_files is not None) and (len(flist)>max_rand_files):
+            flist = flist[:max_rand_files]
         flog.write("Will read {:d} rand files...\n".format(len(flist)))
         flog.flush()
     else:
@@ -152,132 +369,59 @@ def make_lrg_map(isamp,ebv_cut=0.15,star_cut=2500.,weights_path=None):
     # It is useful to know the randoms per sq. deg., which is
     # stored in the FITS header.
     if rank==0:
-        tt = Table.read(flist[0])
-        ran_dens = tt.meta['DENSITY']
+        ran_dens = read_density(flist[0])
         flog.write("Random density "+str(ran_dens)+' per sq.deg. [per file].\n')
         flog.flush()
     #
-    wmap = np.zeros(npix,dtype='f8')
-    rmap = np.zeros(npix,dtype='f8')
-    for i,fn in enumerate(flist):
-      if i%nproc==rank:
-        tt = Table.read(fn)
-        mf = mb + fn[len(rb):-5] + '-lrgmask_v1.1.fits.gz'
-        mm = Table.read(mf)
-        tt['lrg_mask']=mm['lrg_mask']
-        # Restrict to the "observed" area.
-        tt = tt[(tt['NOBS_G']>1)&(tt['NOBS_R']>1)&(tt['NOBS_Z']>1)]
-        # Cut out regions of "high" extinction.
-        tt = tt[(tt['EBV']<ebv_cut)]
-        # and select LRG objects.
-        tt = tt[ tt['lrg_mask']==0 ]
-        # Apply any other cuts we want here, e.g. on stellar density.
-        theta,phi = np.radians(90-tt['DEC']),np.radians(tt['RA'])
-        pixnum    = hp.ang2pix(stars_nside,theta,phi,nest=pxw_nest)
-        sdens     = stars[pixnum]
-        tt        = tt[sdens<star_cut]
-        # Throw away the little islands below the NGC.
-        msk = (tt['RA']>135)&(tt['RA']<170)&(tt['DEC']<-10.5)&(tt['DEC']>-31)
-        msk|= (tt['RA']>215)&(tt['RA']<225)&(tt['DEC']<-10.5)&(tt['DEC']>-20)
-        tt  = tt[~msk]
-        # Random weights want these fields.
-        tt['galdepth_gmag_ebv'] = toMag(tt['GALDEPTH_G' ],3.214,tt['EBV'])
-        tt['galdepth_rmag_ebv'] = toMag(tt['GALDEPTH_R' ],2.165,tt['EBV'])
-        tt['galdepth_zmag_ebv'] = toMag(tt['GALDEPTH_Z' ],1.211,tt['EBV'])
-        tt['psfdepth_w1mag_ebv']= toMag(tt['PSFDEPTH_W1'],0.184,tt['EBV'])
-        tt['psfdepth_w2mag_ebv']= toMag(tt['PSFDEPTH_W2'],0.113,tt['EBV'])
-        # Now weight the randoms (or not).
+    if rank==0:
         if weights_path is not None:
-            wt = get_randoms_weights(tt,weights_path,pz_bin)
-            if i==0: # which should be rank 0.
-                flog.write("Using weights from "+\
-                           weights_path+"\n")
+            flog.write("Using weights from "+\
+                       weights_path+"\n")
         else:
-            wt = np.ones(len(tt))
-            if i==0: flog.write("Ignoring weights\n")
-        #
-        # Now bin the randoms into the map, here we convert coordinate
-        # systems.
-        theta,phi = np.radians(90-tt['DEC']),np.radians(tt['RA'])
-        theta,phi = rot(theta,phi) # C->G coordinates
-        pixnum    = hp.ang2pix(nside,theta,phi,nest=isnest)
-        # Produce weighted and unweighted maps.
-        tmp, _ = np.histogram(pixnum,weights=wt,bins=np.arange(npix+1)-0.5)
-        rmap  += tmp
-        tmp, _ = np.histogram(pixnum,bins=np.arange(npix+1)-0.5)
-        wmap  += tmp
-    rtot = np.zeros(npix,dtype='f8')
-    comm.Reduce(rmap,rtot,op=MPI.SUM,root=0)
-    rmap = rtot
-    wtot = np.zeros(npix,dtype='f8')
-    comm.Reduce(wmap,wtot,op=MPI.SUM,root=0)
-    wmap = wtot
-    wmap = rmap/(wmap+1e-30)
+            flog.write("Ignoring weights\n")
+    files    = [(fn,mb + fn[len(rb):-5] + '-lrgmask_v1.1.fits.gz') for fn in flist]
+    # The weight models are only compiled once (per rank).
+    wmodels  = [None if weights_path is None else RandomsWeights(weights_path,pz_bin) for pz_bin in pz_bins]
+    ran_func = partial(randoms_counts,stars=stars,ebv_cut=ebv_cut,\
+                       star_cut=star_cut,weight_models=wmodels,chunk_size=chunk_size,\
+                       rot_nside=rot_nside)
+    if nworkers>1:
+        smap = pool_sum(ran_func,files,nworkers,start=SparseMap(nval=1+len(isamps)))
+    else:
+        smap = SparseMap(nval=1+len(isamps))
+        for i in work_queue(len(files),comm): smap = smap + ran_func(files[i])
+        smap = reduce_sparse(smap,comm,root=0)
     #
     if rank==0:
+        smap = smap.dense(npix)
+        wtot = smap[0]
         flog.write("Done with random files.\n\n")
-        #
-        # Compute the average number of randoms per pixel.
-        msk  = np.nonzero(rmap>0)[0]
-        avg  = np.mean(rmap[msk])
-        #
-        # Set the mask to be regions with >=1/5 of the average,
-        # i.e. this is an "inclusion mask".
-        # We allow relatively large corrections to make sure we don't
-        # have lots of small holes that give ringing.
-        msk  = np.nonzero(rmap>0.20*avg)[0]
-        #
-        print("Have {:e} total galaxies in masked region.".format(np.sum(dmap[msk])))
-        print("Have {:8.2f} galaxies per masked pixel.".format(np.mean(dmap[msk])))
-        print("Have {:8.2f} randoms  per masked pixel.".format(np.mean(wtot[msk])))
-        flog.write("Have {:e} total galaxies in masked region.\n".format(np.sum(dmap[msk])))
-        flog.write("Have {:8.2f} galaxies per masked pixel.\n".format(np.mean(dmap[msk])))
-        flog.write("Have {:8.2f} randoms  per masked pixel.\n".format(np.mean(wtot[msk])))
-        # Now fill in the masked region.
-        omap      = np.zeros(npix,dtype='f8')
-        omap[msk] = dmap[msk]/rmap[msk]
-        omap[msk] = omap[msk]/np.mean(omap[msk]) - 1
-        omap      = omap.astype('f4')   # Don't need full precision.
-        mask      = np.zeros(npix,dtype='f4')
-        mask[msk] = 1.0
-        # Print some useful numbers.
-        shot = np.sum(dmap[msk]/wmap[msk])**2/np.sum(dmap[msk]/wmap[msk]**2)
-        shot = np.sum(mask)*hp.nside2pixarea(nside,False)/shot
-        ninv = np.sum(mask)*hp.nside2pixarea(nside,False)/np.sum(dmap[msk])
-        nbar = 1.0/ninv * (np.pi/180.)**2 # Per sq.deg.
-        print("Mean of omap is {:e}.".format(np.mean(omap)))
-        print("nbar         is {:f}/deg2".format(nbar))
-        print("1/nbar       is {:e}".format(ninv))
-        print("Shot noise   is {:e}".format(shot))
-        print("Sky fraction is {:f}.".format(np.sum(mask)/mask.size))
-        #
-        flog.write("Mean of omap is {:e}.\n".format(np.mean(omap)))
-        flog.write("nbar         is {:f}/deg2\n".format(nbar))
-        flog.write("1/nbar       is {:e}\n".format(ninv))
-        flog.write("Shot noise   is {:e}\n".format(shot))
-        flog.write("Sky fraction is {:f}\n".format(np.sum(mask)/mask.size))
-        flog.close()
-        # Write the basic maps we always want.
-        for outnside in [NSIDE]:
-            pref = "lrg_s{:02d}".format(isamp)
-            hpex = ".hpx{:04d}_nowghts.fits".format(outnside)
-            nmap = hp.ud_grade(omap,outnside)
-            hp.write_map(pref+"_del"+hpex,nmap,dtype='f4',\
-                     nest=isnest,coord='G',overwrite=True)
-            nmap = hp.ud_grade(mask,outnside)
-            hp.write_map(pref+"_msk"+hpex,nmap,dtype='f4',\
-                     nest=isnest,coord='G',overwrite=True)
+        for i,isamp in enumerate(isamps):
+            write_lrg_map(isamp,dmaps[i],smap[1+i],wtot,flogs[i],partial_sky=partial_sky)
+            flogs[i].close()
+
+
+def make_lrg_map(isamp,**kwargs):
+    """
+    Makes the density map and mask of sample isamp,
+    see make_lrg_maps for the keyword arguments.
+    """
+    make_lrg_maps([isamp],**kwargs)
             
             
 if __name__=="__main__":
     if len(sys.argv)==1:
         # Set a default sample.
-        isamp = 1
+        isamps = [1]
+    elif (len(sys.argv)==2) and (sys.argv[1]=='all'):
+        # All samples from a single pass over the files.
+        isamps = [0,1,2,3,4]
     elif len(sys.argv)==2:
         # Use the argument as isamp.
-        isamp = int(sys.argv[1])
+        isamps = [int(sys.argv[1])]
     else:
-        print("Usage: "+sys.argv[0]+" [isamp]")
+        print("Usage: "+sys.argv[0]+" [isamp or all]")
+        comm = get_comm()
         comm.Barrier()
         comm.Abort(1)
-    make_lrg_map(isamp)
\ No newline at end of file
+    make_lrg_maps(isamps)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# Accumulation of (weighted) object counts into healpix pixels,
+# shared by the data map makers and the mock map makers.
+#
+# np.bincount does a single linear pass over the pixel indices,
+# whereas np.histogram(pixnum,bins=np.arange(npix+1)-0.5) allocates
+# npix+1 bin edges and does a binary search per object, and
+# np.add.at is unbuffered (and very slow). The pixel indices can be
+# in either RING or NEST ordering, the output is in the same ordering.
+import numpy  as np
+import healpy as hp
+
+
+def pixel_sums(pixnum,npix,weights=None,sparse=False,counts=True):
+    """
+    Returns the number of objects in each pixel, and (if weights is
+    not None) the sum of their weights, from a single call.
+
+    pixnum  : ndarray of pixel indices (RING or NEST)
+    npix    : int, the number of pixels (12*nside**2)
+    weights : optional ndarray of per-object weights, or (nw,len(pixnum))
+              ndarray of nw sets of weights, in which case wsum is (nw,...)
+    sparse  : if True, only returns the pixels that contain objects,
+              i.e. (pix,counts) or (pix,counts,wsum) with pix sorted.
+              Otherwise returns full-sky (npix,) arrays counts or
+              (counts,wsum).
+    counts  : if False (and weights is not None), the number of objects
+              is not computed and only wsum (or (pix,wsum)) is returned.
+    """
+    if weights is None: counts = True
+    if sparse:
+        if counts:
+            pix,idx,cnt = np.unique(pixnum,return_inverse=True,return_counts=True)
+            cnt = cnt.astype('f8')
+        else:
+            pix,idx = np.unique(pixnum,return_inverse=True)
+        nbin = len(pix)
+    else:
+        idx,nbin = pixnum,npix
+        if counts: cnt = np.bincount(pixnum,minlength=npix).astype('f8')
+    res = [pix] if sparse else []
+    if counts: res.append(cnt)
+    if weights is not None:
+        wsum = np.array([np.bincount(idx,weights=wt,minlength=nbin) for wt in np.atleast_2d(weights)])
+        res.append(wsum if np.ndim(weights)==2 else wsum[0])
+    return res[0] if len(res)==1 else tuple(res)
+
+
+class SparseMap():
+    """
+    A healpix map that is only stored in the pixels that contain
+    objects: smap.pix are the (sorted, unique) pixel indices and
+    smap.vals is an (nval,len(pix)) ndarray of per-pixel values,
+    e.g. the counts (and the sum of weights). SparseMaps can be
+    added, such that catalog chunks (and ranks) are combined at a
+    cost set by the number of occupied pixels rather than npix.
+    """
+    def __init__(self,pix=None,vals=None,nval=1):
+        self.pix  = np.zeros(0,dtype='i8') if pix is None else pix
+        self.vals = np.zeros((nval,0))     if vals is None else vals
+
+    def __add__(self,other):
+        pix  = np.union1d(self.pix,other.pix)
+        vals = np.zeros((self.vals.shape[0],len(pix)))
+        vals[:,np.searchsorted(pix,self.pix)]  += self.vals
+        vals[:,np.searchsorted(pix,other.pix)] += other.vals
+        return SparseMap(pix,vals)
+
+    def dense(self,npix):
+        """
+        Returns the (nval,npix) full-sky maps.
+        """
+        res = np.zeros((self.vals.shape[0],npix))
+        res[:,self.pix] = self.vals
+        return res
+
+
+def sparse_counts(pixnum,weights=None,counts=True):
+    """
+    Returns a SparseMap with the number of objects in each occupied
+    pixel (vals[0]) and, if weights is not None, the sum of their
+    weights (vals[1]). weights can also be an (nw,len(pixnum)) ndarray,
+    in which case vals[1:] are the sums of each set of weights, all
+    from a single pass over pixnum. If counts is False, the number of
+    objects is not computed and vals only holds the sums of weights.
+    See pixel_sums, which does the work.
+    """
+    if weights is None: counts = True
+    res  = pixel_sums(pixnum,None,weights,sparse=True,counts=counts)
+    vals = [res[1]] if counts else []
+    if weights is not None: vals.extend(np.atleast_2d(res[-1]))
+    return SparseMap(res[0],np.array(vals))
+
+
+def reduce_sparse(smap,comm,root=0):
+    """
+    Sums the SparseMaps of all ranks of comm onto root, only
+    communicating the occupied pixels. Returns the sum on root
+    and None on the other ranks.
+    """
+    smaps = comm.gather(smap,root=root)
+    if comm.Get_rank()!=root: return None
+    total = SparseMap(nval=smap.vals.shape[0])
+    for s in smaps: total = total+s
+    return total
+
+
+def write_sky_map(fn,m,footprint,partial=False,**kwargs):
+    """
+    Writes the healpix map m with hp.write_map (passing kwargs). If
+    partial, only the pixels in the footprint (an ndarray of pixel
+    indices) are written, in the explicit-index cut-sky format, such
+    that the file size scales with the sky fraction. read_sky_map 
+    reads both formats.
+    """
+    if partial:
+        cut = np.full(len(m),hp.UNSEEN,dtype=m.dtype)
+        cut[footprint] = m[footprint]
+        m = cut
+    hp.write_map(fn,m,partial=partial,**kwargs)
+
+
+def read_sky_map(fn,**kwargs):
+    """
+    Reads a (full-sky or partial) healpix map written by write_sky_map,
+    with zeros outside of the footprint of partial maps.
+    """
+    m = hp.read_map(fn,**kwargs)
+    m[m==hp.UNSEEN] = 0.
+    return m
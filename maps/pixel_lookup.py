@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Precomputed pixel-index tables for coordinate rotations and changes
+# of resolution/ordering. A table maps each pixel of one healpix grid to
+# the pixel of another grid (possibly in a different coordinate system)
+# that contains its center, so rotating a map (or pixelizing objects
+# in a different coordinate system) becomes an integer gather instead
+# of per-pixel (or per-object) trigonometry and interpolation.
+#
+# The tables are cached on disk as .npy files (and memory-mapped when
+# loaded, so ranks on the same node share a single copy).
+import numpy  as np
+import healpy as hp
+import os
+from   functools import lru_cache
+
+lookup_dir = 'pixel_lookup'
+
+
+def lookup_fname(nside1,coord1,nside2,coord2,nest1=False,nest2=False,cache_dir=lookup_dir):
+    """
+    Returns the filename of the cached pixel_lookup table.
+    """
+    order = lambda nest: 'nest' if nest else 'ring'
+    return os.path.join(cache_dir,f'{coord1.lower()}{nside1}{order(nest1)}_'+\
+                                  f'{coord2.lower()}{nside2}{order(nest2)}.npy')
+
+
+def compute_lookup(nside1,coord1,nside2,coord2,nest1=False,nest2=False):
+    """
+    Returns the int32 ndarray idx, of length 12*nside1**2, where idx[p] is
+    the pixel of the (nside2,coord2) grid containing the center of pixel p
+    of the (nside1,coord1) grid. coord1 and coord2 are healpy coordinate
+    systems ('c', 'g' or 'e').
+    """
+    theta,phi = hp.pix2ang(nside1,np.arange(12*nside1**2),nest=nest1)
+    if coord1.lower()!=coord2.lower():
+        theta,phi = hp.rotator.Rotator(coord=[coord1,coord2])(theta,phi)
+    return hp.ang2pix(nside2,theta,phi,nest=nest2).astype(np.int32)
+
+
+@lru_cache(maxsize=None)
+def pixel_lookup(nside1,coord1,nside2,coord2,nest1=False,nest2=False,cache_dir=lookup_dir):
+    """
+    Returns the (memory-mapped) table computed by compute_lookup, reading it
+    from cache_dir if it exists and otherwise computing and saving it (by
+    writing to a temporary file that is then renamed). Tables are also kept
+    in memory, so that they are only loaded once per process.
+    """
+    fn = lookup_fname(nside1,coord1,nside2,coord2,nest1,nest2,cache_dir)
+    if not os.path.exists(fn):
+        idx = compute_lookup(nside1,coord1,nside2,coord2,nest1,nest2)
+        os.makedirs(cache_dir,exist_ok=True)
+        tmp = os.path.join(cache_dir,f'.{os.getpid()}.'+os.path.basename(fn))
+        np.save(tmp,idx)
+        os.replace(tmp,fn)
+    return np.load(fn,mmap_mode='r')
+
+
+def rotate_map(m,coord_in,coord_out,nside_out=None,nest_in=False,nest_out=False,cache_dir=lookup_dir):
+    """
+    Returns the healpix map m (in coord_in coordinates) in coord_out
+    coordinates at nside_out (default: the nside of m), by assigning each
+    output pixel the value of the input pixel containing its center. This
+    is a nearest-pixel version of hp.Rotator.rotate_map_pixel, meant for
+    binary masks and maps that are piecewise constant on the input pixels.
+    """
+    nside_in = hp.npix2nside(len(m))
+    if nside_out is None: nside_out = nside_in
+    return m[pixel_lookup(nside_out,coord_out,nside_in,coord_in,nest_out,nest_in,cache_dir)]
+
+
+def sky_coords(nside,coord_out,coord='c',nest=False):
+    """
+    Returns the latitude and longitude (in degrees, e.g. DEC and RA for
+    coord='c') in coord coordinates of the centers of the pixels of the
+    (nside,coord_out) grid.
+    """
+    theta,phi = hp.pix2ang(nside,np.arange(12*nside**2),nest=nest)
+    if coord.lower()!=coord_out.lower():
+        theta,phi = hp.rotator.Rotator(coord=[coord_out,coord])(theta,phi)
+    return 90-np.degrees(theta),np.degrees(phi)%360.
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#
+# Dynamic load balancing for the map makers. Under MPI, rank 0 acts
+# as a master that hands out the next item (e.g. a file) to whichever
+# rank asks for work first, so that ranks which drew small files keep
+# working while others are stuck on large ones. For single-node runs
+# without MPI, pool_sum does the same with a process pool. mpi4py
+# initializes MPI when it is imported, after which forking a process
+# pool is unsafe, so it is only imported on the MPI path (get_comm).
+import numpy as np
+import sys
+from   multiprocessing import Pool
+
+WORK_TAG = 11
+
+
+def work_queue(nitems,comm=None):
+    """
+    Yields the indices (in range(nitems)) of the items that this rank
+    should process. Must be called (and exhausted) by every rank of comm.
+    If comm is None or has a single rank, simply yields range(nitems).
+    Otherwise rank 0 only hands out work (and yields nothing), while
+    ranks 1,...,nproc-1 are given the next item whenever they ask.
+    """
+    if (comm is None) or (comm.Get_size()==1):
+        yield from range(nitems)
+        return
+    rank,nproc = comm.Get_rank(),comm.Get_size()
+    if rank==0:
+        from mpi4py import MPI
+        status = MPI.Status()
+        inext,ndone = 0,0
+        while ndone < nproc-1:
+            comm.recv(source=MPI.ANY_SOURCE,tag=WORK_TAG,status=status)
+            if inext < nitems:
+                comm.send(inext,dest=status.Get_source(),tag=WORK_TAG)
+                inext += 1
+            else:
+                comm.send(None,dest=status.Get_source(),tag=WORK_TAG)
+                ndone += 1
+    else:
+        while True:
+            comm.send(rank,dest=0,tag=WORK_TAG)
+            i = comm.recv(source=0,tag=WORK_TAG)
+            if i is None: return
+            yield i
+
+
+class SerialComm():
+    """
+    A stand-in for MPI.COMM_WORLD in single-process runs, with the
+    few calls used by the map makers, such that they can run (e.g.
+    with pool_sum) without importing mpi4py.
+    """
+    def Get_rank(self):            return 0
+    def Get_size(self):            return 1
+    def bcast(self,obj,root=0):    return obj
+    def gather(self,obj,root=0):   return [obj]
+    def Barrier(self):             pass
+    def Abort(self,errorcode=0):   sys.exit(errorcode)
+
+
+def get_comm(mpi=True):
+    """
+    Returns MPI.COMM_WORLD if mpi, otherwise a SerialComm. mpi4py is
+    only imported (and MPI initialized) in the former case, so runs
+    that use pool_sum should call get_comm(mpi=False).
+    """
+    if not mpi: return SerialComm()
+    from mpi4py import MPI
+    return MPI.COMM_WORLD
+
+
+def pool_sum(func,items,nworkers,start=0):
+    """
+    Returns start plus the sum of func(item) over items, computed by a
+    pool of nworkers processes that each take the next item as they
+    free up. func must be picklable (e.g. a module-level function or a
+    functools.partial of one) and return an ndarray (or any object
+    that can be added to start, e.g. a SparseMap) or a tuple of them,
+    in which case the sum is done element-wise. If items is empty,
+    start is returned. Must not be called after MPI is initialized.
+    """
+    total = start
+    with Pool(nworkers) as pool:
+        for res in pool.imap_unordered(func,items):
+            if isinstance(res,tuple):
+                if not isinstance(total,tuple): total = (total,)*len(res)
+                total = tuple(t+r for t,r in zip(total,res))
+            else: total = total+res
+    return total
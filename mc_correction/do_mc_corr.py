@@ -8,6 +8,8 @@ from mpi4py import MPI
 from glob import glob
 
 from lensing_sims import get_kappa_maps
+sys.path.append('../spectra/')
+from datastore import load_data,save_data
 
 comm  = MPI.COMM_WORLD
 rank  = comm.Get_rank()
@@ -89,18 +91,18 @@ def bin_mc_corr(prefix,ledges=[25.+50*i for i in range(21)],lmax=2000):
 
 def apply_mc_corr(fnin,fnout,kapName,galNames,mccorr_prefixs):
     """
-    multiply cl's in json file by MC norm correction
+    multiply cl's in json file (or DataStore) by MC norm correction.
+    When fnin and fnout are the same DataStore only the corrected 
+    records are rewritten.
     """
-    with open(fnin) as indata:
-        data = json.load(indata)
+    data = load_data(fnin)
+    corr = {}
     for i,galName in enumerate(galNames):
         mccorr = bin_mc_corr(mccorr_prefixs[i],data['ledges'])[:,1]
-        data[f'mccorr_{kapName}_{galName}'] = mccorr.tolist()
-        try:
-            name = f'cl_{kapName}_{galName}'
-            data[name] = (np.array(data[name])*mccorr).tolist()
-        except:
-            name = f'cl_{galName}_{kapName}'
-            data[name] = (np.array(data[name])*mccorr).tolist()
-    with open(fnout, "w") as outfile:
-        json.dump(data, outfile, indent=2)
\ No newline at end of file
+        corr[f'mccorr_{kapName}_{galName}'] = mccorr
+        name = f'cl_{kapName}_{galName}'
+        if name not in data: name = f'cl_{galName}_{kapName}'
+        corr[name] = np.array(data[name])*mccorr
+    data = {key:data[key] for key in data.keys()}
+    data.update(corr)
+    save_data(data,fnout,keys=list(corr.keys()) if fnout==fnin else None)
\ No newline at end of file
@@ -1,7 +1,9 @@
 from do_mc_corr import *
 import sys
 sys.path.append('../')
+sys.path.append('../maps/')
 from globe import NSIDE
+from bitmask import MaskCube
 
 job = int(sys.argv[1])
 
@@ -9,14 +11,12 @@ job = int(sys.argv[1])
 isamp    = 1
 bdir     = '/pscratch/sd/m/mwhite/DESI/MaPar/maps/'
 lrg_mask = hp.read_map(bdir+f'lrg_s0{isamp}_msk.hpx2048.fits')
-north    = hp.read_map('../maps/masks/north_mask.fits')
-des      = hp.read_map('../maps/masks/des_mask.fits')
-decals   = hp.read_map('../maps/masks/decals_mask.fits')
+# the (binary) auxiliary masks are read from the bit-packed
+# cube written by make_aux_masks.py, only when a job uses them
+aux      = MaskCube('../maps/masks/aux_masks.npy')
 PR3mask  = hp.read_map(f'../maps/masks/PR3_lens_mask.fits')
 PR4mask  = hp.read_map(f'../maps/masks/PR4_lens_mask.fits')
 PR4maska = hp.read_map(f'../maps/masks/PR4_lens_mask_alt.fits')
-DECm15   = hp.read_map('../maps/masks/DECm15_mask.fits')
-DECp15   = 1 - DECm15
 
 # baseline LRG mask ("full") correlated with act dr6
 def do_dr6(lrg_mask,lrg_name,option='baseline'):
@@ -38,13 +38,13 @@ if job==9: do_dr6(lrg_mask,f'lrg-full-z{isamp}',option='tonly')
 
 # different LRG masks correlated with PR3
 if job==10: make_mc_cls(f'lrg-full-z{isamp}'  ,lrg_mask,       PR3mask,'c',lensmap='PR3')
-if job==11: make_mc_cls(f'lrg-north-z{isamp}' ,lrg_mask*north, PR3mask,'c',lensmap='PR3')
-if job==12: make_mc_cls(f'lrg-decals-z{isamp}',lrg_mask*decals,PR3mask,'c',lensmap='PR3')
-if job==13: make_mc_cls(f'lrg-des-z{isamp}'   ,lrg_mask*des,   PR3mask,'c',lensmap='PR3')
+if job==11: make_mc_cls(f'lrg-north-z{isamp}' ,lrg_mask*aux.mask('north'), PR3mask,'c',lensmap='PR3')
+if job==12: make_mc_cls(f'lrg-decals-z{isamp}',lrg_mask*aux.mask('decals'),PR3mask,'c',lensmap='PR3')
+if job==13: make_mc_cls(f'lrg-des-z{isamp}'   ,lrg_mask*aux.mask('des'),   PR3mask,'c',lensmap='PR3')
 
 # different LRG masks correlated with PR4
 if job==14: make_mc_cls(f'lrg-full-z{isamp}'  ,lrg_mask,       PR4mask,'c',lensmap='PR4')
-if job==15: make_mc_cls(f'lrg-north-z{isamp}' ,lrg_mask*north, PR4mask,'c',lensmap='PR4')
-if job==16: make_mc_cls(f'lrg-decals-z{isamp}',lrg_mask*decals,PR4mask,'c',lensmap='PR4')
-if job==17: make_mc_cls(f'lrg-des-z{isamp}'   ,lrg_mask*des,   PR4mask,'c',lensmap='PR4')
-if job==18: make_mc_cls(f'lrg-DECp15-z{isamp}',lrg_mask*DECp15,PR4mask,'c',lensmap='PR4')
\ No newline at end of file
+if job==15: make_mc_cls(f'lrg-north-z{isamp}' ,lrg_mask*aux.mask('north'), PR4mask,'c',lensmap='PR4')
+if job==16: make_mc_cls(f'lrg-decals-z{isamp}',lrg_mask*aux.mask('decals'),PR4mask,'c',lensmap='PR4')
+if job==17: make_mc_cls(f'lrg-des-z{isamp}'   ,lrg_mask*aux.mask('des'),   PR4mask,'c',lensmap='PR4')
+if job==18: make_mc_cls(f'lrg-DECp15-z{isamp}',lrg_mask*aux.mask('~DECm15'),PR4mask,'c',lensmap='PR4')
\ No newline at end of file
@@ -6,6 +6,9 @@ import numpy as np
 import healpy as hp
 import copy
 from scipy.interpolate import interp1d
+import sys
+sys.path.append('../../maps/')
+from pixel_counts import pixel_sums
 
 def make_map(catalog,dN_dz,nside=2048,lnM_min=20,lnM_max=80,mask=None,f=1,Mc=10**12.89):
     '''
@@ -52,9 +55,8 @@ def make_map(catalog,dN_dz,nside=2048,lnM_min=20,lnM_max=80,mask=None,f=1,Mc=10*
     weights *= interp1d(dN_dz[:,0],dN_dz[:,1],bounds_error=False,fill_value=0)(z)
         
     # create mock LRG map
-    Map = np.zeros((hp.nside2npix(nside)))
     pix = hp.ang2pix(nside, theta, phi)
-    np.add.at(Map, pix, weights)
+    Map = pixel_sums(pix, hp.nside2npix(nside), weights, counts=False)
     delta = Map/np.mean(Map)-1.
     lrg=hp.ma(delta) 
     if mask is not None:
@@ -1,16 +1,24 @@
 # A wrapper around NaMaster
-# Neatly stores all spectra and covariances in a .json format
+# Neatly stores all spectra and covariances in a DataStore (see datastore.py),
+# with one record per spectrum, window function and covariance block.
 
 import numpy    as np
 import healpy   as hp
 import pymaster as nmt
 import sys
 import json
+import os
+import hashlib
+from collections import OrderedDict
 from os.path import exists
+from time import perf_counter
+from datastore import DataStore
+sys.path.append('../maps/')
 
 readme = "cl_X_Y is the pseudo Cell C^{XY}. wl_X_Y is the window function for C^{XY}. "
 readme+= "cij is a (nmaps,nmaps,nell) ndarray of spectra used to compute the covariance. "
 readme+= "The order of 'map names' defines the order of cij. cov_X_Y_M_N is the covariance of C^{XY} and C^{MN}. "
+readme+= "cij_resid (if present) is the rms fractional residual of the polynomial fits used for cij. "
 
 
 def get_bins(ledges,nside):
@@ -28,59 +36,209 @@ def get_bins(ledges,nside):
     bins = nmt.NmtBin(nside,bpws=bpws,ells=ells,weights=np.ones_like(ells))
     return bins
 
+
+def mask_hash(msk):
+    """
+    Returns a hex digest of the contents of a healpix mask (or map), 
+    which is used to identify masks when caching NaMaster workspaces
+    and (map,mask) pairs in the FieldRegistry.
+    """
+    return hashlib.sha1(np.ascontiguousarray(msk).view(np.uint8)).hexdigest()
+
+
+class FieldRegistry():
+    """
+    A cache of NmtFields keyed by a caller-supplied key (e.g. the name 
+    of the map and the hash of its mask), such that the spherical 
+    harmonic transform of each masked map is only computed once, no 
+    matter how many spectra and covariances it enters. Registries are
+    meant to live for a single calculation (e.g. a full_master call),
+    so that the fields are freed with it. If maxsize is not None, at 
+    most maxsize (least-recently-used) fields are kept.
+    """
+    def __init__(self, maxsize=None):
+        """
+        maxsize : optional int, maximum number of fields held in memory
+        """
+        self.maxsize = maxsize
+        self.fields  = OrderedDict()
+        self.hits    = 0
+        self.misses  = 0
+
+    def get(self, key, map_, msk):
+        """
+        Returns the NmtField for map_ (masked with msk) stored under
+        key, only computing it if it is not already cached.
+        """
+        if key in self.fields:
+            self.hits += 1
+            self.fields.move_to_end(key)
+            return self.fields[key][0]
+        self.misses += 1
+        field = nmt.NmtField(msk,[map_])
+        # keep a reference to map_, such that keys built 
+        # from id(map_) stay valid while the field is cached
+        self.fields[key] = (field,map_)
+        if self.maxsize is not None:
+            while len(self.fields) > self.maxsize: self.fields.popitem(last=False)
+        return field
+
+    def clear(self):
+        """
+        Drops all cached fields and resets the counters.
+        """
+        self.fields.clear()
+        self.hits   = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of hits, misses
+        and the current number of cached fields.
+        """
+        return {'hits':self.hits,'misses':self.misses,'size':len(self.fields)}
+
+
+def workspace_key(hashes,ledges,nside):
+    """
+    Returns a hex digest identifying the coupling matrix (or coupling
+    coefficients) for the masks with hashes (see mask_hash), the 
+    ell-bins ledges and healpix nside.
+    """
+    key = '_'.join(hashes)+'_'+'_'.join([str(int(l)) for l in ledges])+f'_{nside}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def cached_workspace(fn,wsp,compute):
+    """
+    Reads the NaMaster (covariance) workspace wsp from fn if it exists.
+    Otherwise calls compute(wsp) and saves the result to fn (by writing 
+    to a temporary file that is then renamed). fn=None disables the cache.
+    """
+    if (fn is not None) and exists(fn):
+        wsp.read_from(fn)
+        return wsp
+    compute(wsp)
+    if fn is not None:
+        # the pid makes the temporary file unique when
+        # several (MPI) processes fill the same cache
+        os.makedirs(os.path.dirname(fn) or '.',exist_ok=True)
+        tmp = os.path.join(os.path.dirname(fn),f'.{os.getpid()}.'+os.path.basename(fn))
+        wsp.write_to(tmp)
+        os.replace(tmp,fn)
+    return wsp
+
+
+def get_workspace(field1,field2,bins,key,cache_dir=None):
+    """
+    Returns the NmtWorkspace (coupling matrix) for field1 x field2, which
+    only depends on their masks and the binning, identified by key (see
+    workspace_key). If cache_dir is provided the workspace is read from 
+    (or saved to) cache_dir/wsp_{key}.fits.
+    """
+    fn = None if cache_dir is None else os.path.join(cache_dir,f'wsp_{key}.fits')
+    return cached_workspace(fn,nmt.NmtWorkspace(),lambda w: w.compute_coupling_matrix(field1,field2,bins))
+
+
+def get_cov_workspace(fields,key,cache_dir=None):
+    """
+    Returns the NmtCovarianceWorkspace (coupling coefficients) for the
+    four fields, which only depends on their four masks, identified by 
+    key (see workspace_key). If cache_dir is provided the workspace is 
+    read from (or saved to) cache_dir/cwsp_{key}.fits.
+    """
+    fn = None if cache_dir is None else os.path.join(cache_dir,f'cwsp_{key}.fits')
+    return cached_workspace(fn,nmt.NmtCovarianceWorkspace(),lambda w: w.compute_coupling_coefficients(*fields))
+
     
-def master_cl(ledges,map1,msk1,map2,msk2):
+def field_keys(maps,hashes,keys=None):
+    """
+    Returns the FieldRegistry keys of maps (masked with the masks with
+    hashes, see mask_hash): (keys[n],hashes[n]) if keys (e.g. the map
+    names) are provided and (id(maps[n]),hashes[n]) otherwise.
+    """
+    if keys is None: keys = [id(m) for m in maps]
+    return [(k,h) for k,h in zip(keys,hashes)]
+
+
+def master_cl(ledges,map1,msk1,map2,msk2,cache_dir=None,fields=None,keys=None):
     """
     A bare-bones pseudo-cell calculator. ledges (list)
     defines the edges of the ell-bins. The maps and masks
     are assumed to be in healpix format with the same nside.
+    If cache_dir is provided the coupling matrix is read 
+    from (or saved to) cache_dir. The fields are drawn from 
+    the FieldRegistry fields (a new one if None), such that 
+    passing the same registry to several calls only transforms
+    each map once. keys optionally names map1 and map2 in the
+    registry (see field_keys).
     
     Returns the effective-ells, the window function, and the
     pseudo-cells.
     """
-    nside = int((len(map1)/12)**0.5)
-    bins  = get_bins(ledges,nside)
-    field1 = nmt.NmtField(msk1,[map1])
-    field2 = nmt.NmtField(msk2,[map2])
-    wsp = nmt.NmtWorkspace()
-    wsp.compute_coupling_matrix(field1,field2,bins)
+    nside  = int((len(map1)/12)**0.5)
+    bins   = get_bins(ledges,nside)
+    hashes = [mask_hash(msk1),mask_hash(msk2)]
+    if fields is None: fields = FieldRegistry()
+    fkeys  = field_keys([map1,map2],hashes,keys)
+    field1 = fields.get(fkeys[0],map1,msk1)
+    field2 = fields.get(fkeys[1],map2,msk2)
+    key = workspace_key(hashes,ledges,nside)
+    wsp = get_workspace(field1,field2,bins,key,cache_dir=cache_dir)
     ell = bins.get_effective_ells()
     w12 = wsp.get_bandpower_windows()[0,:,0,:]
     c12 = nmt.compute_full_master(field1,field2,bins,workspace=wsp)[0,:]
     return ell,w12,c12
 
 
-def master_cov(ledges,map1,msk1,map2,msk2,map3,msk3,map4,msk4,c13,c14,c23,c24):
+def master_cov(ledges,map1,msk1,map2,msk2,map3,msk3,map4,msk4,c13,c14,c23,c24,cache_dir=None,\
+               fields=None,keys=None):
     """
     A bare-bones covariance calculator. ledges (list)
     defines the edges of the ell-bins. The maps and masks
     are assumed to be in healpix format with the same nside.
+    If cache_dir is provided the coupling matrices and 
+    coefficients are read from (or saved to) cache_dir.
+    The fields are drawn from the FieldRegistry fields (a
+    new one if None, see master_cl), and keys optionally
+    names the four maps in the registry.
     """
-    nside = int((len(map1)/12)**0.5)
-    bins  = get_bins(ledges,nside)
-    field1 = nmt.NmtField(msk1,[map1])
-    field2 = nmt.NmtField(msk2,[map2])
-    field3 = nmt.NmtField(msk3,[map3])
-    field4 = nmt.NmtField(msk4,[map4])
-    wsp12 = nmt.NmtWorkspace()
-    wsp12.compute_coupling_matrix(field1,field2,bins)
-    wsp34 = nmt.NmtWorkspace()
-    wsp34.compute_coupling_matrix(field3,field4,bins)
-    cw = nmt.NmtCovarianceWorkspace()
-    cw.compute_coupling_coefficients(field1,field2,field3,field4)
+    nside  = int((len(map1)/12)**0.5)
+    bins   = get_bins(ledges,nside)
+    maps   = [map1,map2,map3,map4]
+    msks   = [msk1,msk2,msk3,msk4]
+    hashes = [mask_hash(msk) for msk in msks]
+    if fields is None: fields = FieldRegistry()
+    field1,field2,field3,field4 = [fields.get(k,m,msk) for k,m,msk in \
+                                   zip(field_keys(maps,hashes,keys),maps,msks)]
+    wsp12 = get_workspace(field1,field2,bins,workspace_key(hashes[:2],ledges,nside),cache_dir=cache_dir)
+    wsp34 = get_workspace(field3,field4,bins,workspace_key(hashes[2:],ledges,nside),cache_dir=cache_dir)
+    cw = get_cov_workspace([field1,field2,field3,field4],workspace_key(hashes,[],nside),cache_dir=cache_dir)
     cov = nmt.gaussian_covariance(cw,0,0,0,0,[c13],[c14],[c23],[c24],wa=wsp12,wb=wsp34)  
     return cov
 
 
-def cij_poly_approx(data,lmax=3000,expfit=True):
+def cij_poly_approx(data,lmax=3000,expfit=True,deg=14,return_resid=False):
     """
-    Given a set of data (pseudo-cells in a .json file following
-    the format of full_master) returns a (nmap,nmap,3*nside)
-    ndarray approximating the measured pseudo-cells with 
-    an 8-th order polynomial. Extrapolates with zeros for ell
+    Given a set of data (pseudo-cells in a DataStore or .json dict following
+    the format of full_master) returns a symmetric (nmap,nmap,3*nside)
+    ndarray approximating the measured pseudo-cells with a degree-deg
+    polynomial (in log-space if expfit). Extrapolates with zeros for ell
     larger than where the spectra have been measured. 
     
-    WARNING: If the .json file is missing a spectrum (e.g. when
+    If fewer than deg+1 ell's were measured, the degree is reduced to
+    len(ell)-1 (i.e. the fits interpolate the measured spectra).
+    
+    All spectra are fit at once: the polynomials are expanded in a shared
+    Chebyshev basis (which is much better conditioned than the monomials
+    used by np.polyfit) and the weighted least-squares problems are solved
+    with a single batched QR decomposition.
+    
+    If return_resid, also returns a (nmap,nmap) ndarray with the rms 
+    fractional residual of each fit at the measured ell's (nan for 
+    spectra that are missing or could not be fit).
+    
+    WARNING: If the data are missing a spectrum (e.g. when
     full_master only computes the auto-correlations) then 
     cij_poly_approx "approximates" the spectrum with zeros.
     """
@@ -88,46 +246,118 @@ def cij_poly_approx(data,lmax=3000,expfit=True):
     nside  = data['nside']
     ell    = np.array(data['ell'])
     nmaps  = len(names)
+    lval   = np.arange(min(max(ell),lmax))
     result = np.zeros((nmaps,nmaps,3*nside))
-    for i in range(nmaps):
-        for j in range(i,nmaps):
-            try:
-                lval  = np.arange(min(max(ell),lmax))
-                cl    = np.array(data[f'cl_{names[i]}_{names[j]}'])
-                if expfit: cl = np.log(np.abs(cl))
-                coeff = np.polyfit(ell,cl,14,w=1/cl**2)
-                result[i,j,:len(lval)] = np.exp(np.poly1d(coeff)(lval))
-            except:
-                continue
+    resid  = np.nan*np.ones((nmaps,nmaps))
+    # collect the measured spectra (upper triangle)
+    pairs  = [(i,j) for i in range(nmaps) for j in range(i,nmaps) if f'cl_{names[i]}_{names[j]}' in data]
+    if len(pairs)==0: return (result,resid) if return_resid else result
+    cl     = np.array([data[f'cl_{names[i]}_{names[j]}'] for i,j in pairs])
+    Y      = np.log(np.abs(cl)) if expfit else cl.copy()
+    good   = np.all(np.isfinite(Y)&(Y!=0),axis=1)
+    for p in np.where(~good)[0]:
+        i,j = pairs[p]
+        print(f'cij_poly_approx: could not fit cl_{names[i]}_{names[j]}, approximating with zeros')
+    pairs,cl,Y = [pairs[p] for p in np.where(good)[0]],cl[good],Y[good]
+    if len(pairs)==0: return (result,resid) if return_resid else result
+    # shared Chebyshev basis on [min(ell),max(ell)], with at most
+    # as many coefficients as there are measured ell's
+    deg    = min(deg,len(ell)-1)
+    x      = lambda l: 2*(l-ell[0])/(ell[-1]-ell[0])-1
+    A      = np.polynomial.chebyshev.chebvander(x(ell),deg)
+    # weighted least squares, with the same (1/Y**2) 
+    # weights as the original np.polyfit-based fit
+    W      = 1/Y**2
+    Q,R    = np.linalg.qr(W[:,:,None]*A[None,:,:])
+    coeff  = np.linalg.solve(R,np.einsum('pnd,pn->pd',Q,W*Y)[:,:,None])[:,:,0]
+    fit    = np.dot(coeff,A.T)
+    model  = np.dot(coeff,np.polynomial.chebyshev.chebvander(x(lval),deg).T)
+    if expfit: fit,model = np.exp(fit),np.exp(model)
+    I,J    = np.array(pairs).T
+    result[I,J,:len(lval)] = model
+    result[J,I,:len(lval)] = model
+    frac   = np.sqrt(np.mean((fit/(np.abs(cl) if expfit else cl)-1)**2,axis=1))
+    resid[I,J] = frac
+    resid[J,I] = frac
+    if return_resid: return result,resid
     return result
     
     
+def cov_groups(pairs,hashes):
+    """
+    Groups the covariance blocks (a,b), b>=a, of the spectra in pairs
+    by the four masks that they depend on (identified by their hashes, 
+    see mask_hash). All blocks in a group share the same coupling 
+    coefficients (NmtCovarianceWorkspace). 
+    
+    Returns a list of lists of (a,b).
+    """
+    groups = {}
+    for a in range(len(pairs)):
+        for b in range(a,len(pairs)):
+            i,j = pairs[a]
+            k,l = pairs[b]
+            key = (hashes[i],hashes[j],hashes[k],hashes[l])
+            groups.setdefault(key,[]).append((a,b))
+    return list(groups.values())
+
+
 def full_master(ledges, maps, msks, names, fnout, lmin=20, lmax=1000, do_cov=False, cij=None,
-                only_auto=False, pairs=None, overwrite=False, overwrite_cov=False):
+                only_auto=False, pairs=None, overwrite=False, overwrite_cov=False, comm=None,
+                cache_dir=None, fields=None):
     """
-    Computes power spectra and covariances and saves them in a .json format.
-    It is assumed that all maps and masks have the same nside.
+    Computes power spectra and covariances and saves them in a DataStore
+    (see datastore.py). Each pseudo-Cell, window function and covariance 
+    block is written (atomically) as its own record as soon as it is 
+    computed, so a killed job can be restarted and will skip every record 
+    that is already in the store. It is assumed that all maps and masks 
+    have the same nside.
     
     ledges   : list of lists of ell-bin edges 
     maps     : list of maps in healpix format
     msks     : list of masks in healpix format
     names    : list of strings to identify each map+mask pair with
-    fnout    : string, filename of the output, should end with .json
+    fnout    : string, directory of the output DataStore
     lmin     : int, only saves data with ell > lmin
     lmax     : int, only saves data with ell < lmax
     do_cov   : to compute the covariance or to not?
     cij      : optional (nmaps,nmaps,3*nside) ndarray. The spectra
                used when estimating the covariance matrix. Order of 
                spectra should match names, i.e. cij[1,2] corresponds to 
-               Cell[names[1],names[2]]. Only the upper triangle is used. 
-               Approximates spectra with a polynomial fit to the measured 
-               spectra if not provided. 
+               Cell[names[1],names[2]]. Should be symmetric in its first
+               two indices. Approximates spectra with a polynomial fit to 
+               the measured spectra if not provided (see cij_poly_approx), 
+               in which case the rms fractional residuals of the fits are 
+               saved as cij_resid.
     only_auto: if True, only compute the auto-correlation's of the input maps. 
                If cij isn't provided, assumes that the cross-correlations are
                zero when computing the covariance.
     overwrite: if False (default), doesn't recompute prexisting pseudo-Cells and 
-               covariances of the existing .json file
+               covariances of the existing DataStore. If True, the store is
+               cleared before starting.
+    comm     : optional MPI communicator (e.g. MPI.COMM_WORLD). If provided, 
+               rank 0 computes the coupling matrices and pseudo-Cells, and
+               then hands out the covariance blocks (see maps/work_queue.py)
+               to the other ranks, which read the coupling matrices from 
+               cache_dir and write their blocks to the store. Blocks that 
+               share the same four masks are handed out together, so that 
+               their coupling coefficients are only computed once. Should
+               be called by all ranks.
+    cache_dir: optional directory in which the coupling matrices and 
+               coefficients are cached, keyed by a hash of the masks,
+               ledges and nside (see workspace_key). Spectra that share 
+               the same masks always share the same coupling matrix. 
+               Defaults to fnout/nmt_cache when comm has several ranks.
+    fields   : optional FieldRegistry shared with other calls (e.g. of 
+               master_cl), keyed by names. If None, a registry is made 
+               for (and freed at the end of) this call.
     """
+    if fnout.endswith('.json'):
+        raise ValueError(f'full_master writes a DataStore directory, not a .json file ({fnout})')
+    if comm is None: rank,nproc = 0,1
+    else:            rank,nproc = comm.Get_rank(),comm.Get_size()
+    # the ranks share the coupling matrices through the cache
+    if (nproc>1) and (cache_dir is None): cache_dir = os.path.join(fnout,'nmt_cache')
     # enumerate list of pairs
     nmaps = len(maps)
     pairs_ = []
@@ -137,10 +367,6 @@ def full_master(ledges, maps, msks, names, fnout, lmin=20, lmax=1000, do_cov=Fal
     if only_auto: pairs_ = [[i,i] for i in range(nmaps)]
     if pairs is not None: pairs_ = pairs
     pairs = pairs_ ; nspec = len(pairs) 
-    # and a shortcut to save json file
-    def write_outdata(outdata):
-        with open(fnout, "w") as outfile:
-            json.dump(outdata, outfile, indent=2)
     # infer nside, get effective ell's and 
     # pixel window function
     nside   = int((len(maps[0])/12)**0.5)
@@ -150,60 +376,110 @@ def full_master(ledges, maps, msks, names, fnout, lmin=20, lmax=1000, do_cov=Fal
     # downselect the ell-bins when saving
     imin   = np.argwhere(np.array(ell)>lmin)[0][0]
     imax   = np.argwhere(np.array(ell)<lmax)[-1][0]+1
+    ledges_all = ledges
     ledges = ledges[imin:imax+1]
     ell    = ell[imin:imax]
-    # load or create outdata
-    if exists(fnout) and (not overwrite):
-        with open(fnout) as outfile:
-            outdata = json.load(outfile)
-            # update the input names so that it's possible to 
-            # add maps to an existing .json file post facto. 
-            # However, nside and ledges cannot be updated without
-            # overwriting the entire file.
-            outdata['map names'] = names
-            outdata['pixwin']    = pixwin.tolist()
-    else:
-        outdata = {'README':readme,'nside':nside,'map names':names,
-                   'ledges':ledges,'ell':ell.tolist(),'pixwin':pixwin.tolist()}
-    write_outdata(outdata)
+    # load or create outdata (only rank 0 writes the
+    # metadata, spectra and cij)
+    outdata = DataStore(fnout,mode='a')
+    if rank==0:
+        if overwrite: outdata.clear()
+        if 'nside' not in outdata:
+            outdata['README'] = readme
+            outdata['nside']  = nside
+            outdata['ledges'] = [int(l) for l in ledges]
+            outdata['ell']    = np.array(ell)
+        # update the input names so that it's possible to 
+        # add maps to an existing store post facto. 
+        # However, nside and ledges cannot be updated without
+        # overwriting the entire store.
+        outdata['map names'] = names
+        outdata['pixwin']    = pixwin
     
-    # define fields and workspaces
-    # compute window functions and pseudo-Cells (if not already computed)
-    fields = [nmt.NmtField(msks[i],[maps[i]]) for i in range(nmaps)]
-    wsps   = [nmt.NmtWorkspace() for i in range(nspec)]
-    for a in range(nspec):
-        i,j = pairs[a]
-        wsps[a].compute_coupling_matrix(fields[i],fields[j],bins)
-        wl_fname = f'wl_{names[i]}_{names[j]}'
-        cl_fname = f'cl_{names[i]}_{names[j]}'
-        if (cl_fname in outdata) and (not overwrite):
-            continue
-        else:
-            wl = wsps[a].get_bandpower_windows()[0,imin:imax,0,:]
-            cl = nmt.compute_full_master(fields[i],fields[j],bins,workspace=wsps[a])[0,imin:imax]
-            outdata[wl_fname] = wl.tolist()
-            outdata[cl_fname] = cl.tolist()
-            write_outdata(outdata)   
+    # The fields are keyed by the map names and the mask hashes, and 
+    # (unless a registry is passed) only kept for the duration of this call.
+    hashes = [mask_hash(msk) for msk in msks]
+    own_fields = fields is None
+    if own_fields: fields = FieldRegistry()
+    fkeys  = field_keys(maps,hashes,names)
+    field  = lambda i: fields.get(fkeys[i],maps[i],msks[i])
+    wkeys  = [workspace_key([hashes[i],hashes[j]],ledges_all,nside) for i,j in pairs]
+    wdict  = {}
+    def workspace(a):
+        # the coupling matrix of spectrum a (shared by all spectra with
+        # the same masks), read from cache_dir if it was computed before
+        if wkeys[a] not in wdict:
+            i,j = pairs[a]
+            wdict[wkeys[a]] = cached_workspace(None if cache_dir is None else \
+                                  os.path.join(cache_dir,f'wsp_{wkeys[a]}.fits'),nmt.NmtWorkspace(),\
+                                  lambda w: w.compute_coupling_matrix(field(i),field(j),bins))
+        return wdict[wkeys[a]]
     
-    # If "theory spectra" (for the covariance) are not provided, approximate
-    # with a polynomial fit to the measured cl's
-    if cij is None: cij = cij_poly_approx(outdata)
-    outdata['cij'] = cij.tolist()
-    write_outdata(outdata)
+    # rank 0 computes (and caches) the coupling matrices, window functions
+    # and pseudo-Cells (if not already computed) and cij
+    if rank==0:
+        for a in range(nspec):
+            i,j = pairs[a]
+            wsp = workspace(a)
+            wl_fname = f'wl_{names[i]}_{names[j]}'
+            cl_fname = f'cl_{names[i]}_{names[j]}'
+            if (cl_fname in outdata) and (not overwrite): continue
+            outdata[wl_fname] = wsp.get_bandpower_windows()[0,imin:imax,0,:]
+            outdata[cl_fname] = nmt.compute_full_master(field(i),field(j),bins,workspace=wsp)[0,imin:imax]
+        # If "theory spectra" (for the covariance) are not provided, approximate
+        # with a polynomial fit to the measured cl's
+        if cij is None: 
+            cij,resid = cij_poly_approx(outdata,return_resid=True)
+            outdata['cij_resid'] = resid
+        outdata['cij'] = cij
+    if comm is not None: cij = comm.bcast(cij,root=0)
             
     # start working on the covariance (if applicable)
-    if not do_cov: return 'all done'
-    for a in range(nspec):
-        for b in range(a,nspec):
+    if not do_cov:
+        if own_fields: fields.clear()
+        return 'all done'
+    def cov_fname(a,b):
+        i,j = pairs[a]
+        k,l = pairs[b]
+        return f'cov_{names[i]}_{names[j]}_{names[k]}_{names[l]}'
+    # The other ranks only start once the coupling matrices are in cache_dir.
+    if comm is not None: comm.Barrier()
+    # The blocks still to do, grouped by the masks that they depend on,
+    # are listed once by rank 0 (before any rank writes to the store) and
+    # broadcast, such that every rank sees the same list. The groups are 
+    # handed out (most expensive, i.e. largest, first) to whichever rank 
+    # is free, see maps/work_queue.py.
+    groups = None
+    if rank==0:
+        groups = cov_groups(pairs,hashes)
+        groups = [[ab for ab in group if overwrite_cov or (cov_fname(*ab) not in outdata)] for group in groups]
+        groups = sorted([group for group in groups if len(group)>0],key=len,reverse=True)
+    if comm is not None: groups = comm.bcast(groups,root=0)
+    if comm is None:
+        queue = range(len(groups))
+    else:
+        # only imported when needed, such that mpi4py
+        # isn't required for serial runs
+        from work_queue import work_queue
+        queue = work_queue(len(groups),comm)
+    for g in queue:
+        group = groups[g]
+        a,b = group[0]
+        i,j = pairs[a]
+        k,l = pairs[b]
+        t0  = perf_counter()
+        key = workspace_key([hashes[i],hashes[j],hashes[k],hashes[l]],[],nside)
+        fn  = None if cache_dir is None else os.path.join(cache_dir,f'cwsp_{key}.fits')
+        cw  = cached_workspace(fn,nmt.NmtCovarianceWorkspace(),\
+                               lambda w: w.compute_coupling_coefficients(field(i),field(j),field(k),field(l)))
+        print(f'rank {rank}: coupling coefficients for {cov_fname(a,b)} ({len(group)} blocks) in {perf_counter()-t0:.1f} s',flush=True)
+        for a,b in group:
             i,j = pairs[a]
             k,l = pairs[b]
-            cov_fname = f'cov_{names[i]}_{names[j]}_{names[k]}_{names[l]}'
-            if (cov_fname in outdata) and (not overwrite_cov):
-                continue
-            else:
-                cw = nmt.NmtCovarianceWorkspace()
-                cw.compute_coupling_coefficients(fields[i],fields[j],fields[k],fields[l])
-                cov = nmt.gaussian_covariance(cw,0,0,0,0,[cij[i,k]],[cij[i,l]],\
-                                             [cij[j,k]],[cij[j,l]],wa=wsps[a],wb=wsps[b])  
-                outdata[cov_fname] = cov[imin:imax,imin:imax].tolist()
-                write_outdata(outdata)
+            t0  = perf_counter()
+            cov = nmt.gaussian_covariance(cw,0,0,0,0,[cij[i,k]],[cij[i,l]],\
+                                         [cij[j,k]],[cij[j,l]],wa=workspace(a),wb=workspace(b))  
+            outdata[cov_fname(a,b)] = cov[imin:imax,imin:imax]
+            print(f'rank {rank}: {cov_fname(a,b)} in {perf_counter()-t0:.1f} s',flush=True)
+    if own_fields: fields.clear()
+    if comm is not None: comm.Barrier()
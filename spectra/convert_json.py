@@ -0,0 +1,11 @@
+# Converts a .json data product (written by full_master) to a DataStore
+# (see datastore.py), which is much faster to load.
+#
+# Usage: python convert_json.py input.json output_directory
+import sys
+from datastore import json_to_store
+
+if __name__ == '__main__':
+    fnjson,path = sys.argv[1:3]
+    store = json_to_store(fnjson,path)
+    print(f'Wrote {len(store.keys())} records to {path}')
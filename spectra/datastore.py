@@ -0,0 +1,133 @@
+# A binary alternative to the .json data products written by full_master.
+#
+# A data store is a directory containing one .npy file per array (spectra,
+# window functions, covariance blocks, cij, pixwin, ...) and a small
+# meta.json file for everything else (README, nside, map names, ledges).
+# Arrays are memory-mapped when read, so only the records that are actually
+# used are loaded from disk, and nothing needs to be parsed. Each record is
+# written once (to a temporary file that is then atomically renamed), so a
+# store can be safely added to one record at a time.
+#
+# DataStore objects behave like the dictionaries returned by json.load,
+# i.e. data['cl_X_Y'] works for both, such that the packing functions in
+# likelihoods/pack_data_v2.py accept either.
+
+import numpy as np
+import json
+import os
+
+class DataStore():
+    """
+    Dictionary-like access to a directory of .npy records
+    and a meta.json file.
+    """
+    def __init__(self, path, mode='r'):
+        """
+        path : string, the directory of the store
+        mode : 'r' (read-only) or 'a' (create if needed and allow writes)
+        """
+        self.path = path
+        self.mode = mode
+        self.fnmeta = os.path.join(path,'meta.json')
+        if mode == 'a': os.makedirs(path,exist_ok=True)
+        elif not os.path.isdir(path):
+            raise FileNotFoundError(f'{path} is not a data store')
+        self.meta = {}
+        if os.path.exists(self.fnmeta):
+            with open(self.fnmeta) as infile:
+                self.meta = json.load(infile)
+
+    def fname(self, key):
+        return os.path.join(self.path,f'{key}.npy')
+
+    def __contains__(self, key):
+        return (key in self.meta) or os.path.exists(self.fname(key))
+
+    def __getitem__(self, key):
+        if key in self.meta: return self.meta[key]
+        try:
+            return np.load(self.fname(key),mmap_mode='r')
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if self.mode != 'a':
+            raise PermissionError(f'{self.path} was opened read-only')
+        if isinstance(value,np.ndarray):
+            # write to a temporary file and then rename, such that
+            # a record either exists in full or not at all
+            tmp = os.path.join(self.path,f'.{key}.tmp.npy')
+            np.save(tmp,value)
+            os.replace(tmp,self.fname(key))
+        else:
+            self.meta[key] = value
+            self.write_meta()
+
+    def __delitem__(self, key):
+        if key in self.meta:
+            del self.meta[key]
+            self.write_meta()
+        else:
+            os.remove(self.fname(key))
+
+    def write_meta(self):
+        tmp = self.fnmeta+'.tmp'
+        with open(tmp,'w') as outfile:
+            json.dump(self.meta,outfile,indent=2)
+        os.replace(tmp,self.fnmeta)
+
+    def keys(self):
+        arrays = [fn[:-4] for fn in os.listdir(self.path) if fn.endswith('.npy') and not fn.startswith('.')]
+        return list(self.meta.keys()) + sorted(arrays)
+
+    def clear(self):
+        """
+        Removes every record (and the metadata) from the store.
+        """
+        for key in self.keys(): del self[key]
+
+
+def load_data(fn):
+    """
+    Returns the data product fn, which is either a .json file
+    (returned as a dictionary) or a DataStore directory (whatever 
+    its name).
+    """
+    if fn.endswith('.json') and not os.path.isdir(fn):
+        with open(fn) as infile:
+            return json.load(infile)
+    return DataStore(fn)
+
+
+def save_data(data, fn, keys=None):
+    """
+    Writes data (a dictionary or DataStore) to fn, which is either a .json 
+    file or a DataStore directory. When writing to a DataStore only the 
+    records in keys (default: all of them) are written, while a .json file
+    is always rewritten in full. Lists of numbers are saved as .npy 
+    records, while strings and lists of strings (or ints, e.g. ledges) 
+    go into meta.json.
+    """
+    if keys is None: keys = list(data.keys())
+    if fn.endswith('.json'):
+        out = {}
+        for key in data.keys():
+            value = data[key]
+            out[key] = value.tolist() if isinstance(value,np.ndarray) else value
+        with open(fn,'w') as outfile:
+            json.dump(out,outfile,indent=2)
+        return out
+    store = DataStore(fn,mode='a')
+    for key in keys:
+        value = data[key]
+        if key in ['README','nside','map names','ledges']: store[key] = value
+        elif isinstance(value,list): store[key] = np.array(value)
+        else: store[key] = value
+    return store
+
+
+def json_to_store(fnjson, path):
+    """
+    Converts a .json data product (see full_master) to a DataStore.
+    """
+    return save_data(load_data(fnjson),path)
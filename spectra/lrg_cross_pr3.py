@@ -10,7 +10,7 @@ lrg_masks = [hp.read_map(f'../maps/masks/lrg_s0{isamp}_msk.hpx2048.fits') for is
 pr3_map   = [hp.read_map(f'../maps/PR3_lens_kap_filt.hpx2048.fits')]
 pr3_mask  = [hp.read_map(f'../maps/masks/PR3_lens_mask.fits')]
 pr3_nkk   = np.loadtxt(f'../data/PR3_lens_nlkk_filt.txt')
-fnout     = f'lrg_cross_pr3.json'
+fnout     = f'lrg_cross_pr3'
 
 # give our maps & masks some names
 kapNames = ['PR3']
@@ -24,9 +24,9 @@ cij      = np.loadtxt(f'fiducial/cls_LRGxPR4_bestFit.txt').reshape((5,5,3*2048))
 ells     = np.arange(cij.shape[-1])
 cij[0,0] = np.interp(ells,pr3_nkk[:,0],pr3_nkk[:,2],right=0)
 
-# compute power spectra and window functions, save to json file
+# compute power spectra and window functions, save to a DataStore
 pairs = [[0,1],[0,2],[0,3],[0,4],[1,1],[2,2],[3,3],[4,4]]
-full_master(LEDGES,maps,msks,names,fnout,cij=cij,do_cov=True,pairs=pairs)
+full_master(LEDGES,maps,msks,names,fnout,cij=cij,do_cov=True,pairs=pairs,cache_dir='nmt_cache')
 
 # apply MC correction
 bdir = '../mc_correction/sims/'
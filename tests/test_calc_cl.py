@@ -0,0 +1,30 @@
+# Tests of spectra/calc_cl.py (require NaMaster and healpy).
+# Run from the repository root: python -m pytest tests
+import numpy as np
+import os
+import sys
+import pytest
+pytest.importorskip('pymaster')
+pytest.importorskip('healpy')
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(here,'..'))
+sys.path.append(os.path.join(here,'..','spectra'))
+from globe   import LEDGES
+from calc_cl import cij_poly_approx,get_bins
+
+
+def test_cij_poly_approx_globe_ledges():
+    # the ell's saved by full_master (with its default lmin and lmax)
+    # for the repo's binning, which are fewer than deg+1=15
+    nside = 2048
+    ell   = np.array(get_bins(LEDGES,nside).get_effective_ells())
+    ell   = ell[(ell>20)&(ell<1000)]
+    assert len(ell) < 15
+    cl    = lambda amp: amp*(ell/100.)**-1.2
+    data  = {'map names':['A','B'],'nside':nside,'ell':ell,\
+             'cl_A_A':cl(1e-5),'cl_A_B':cl(3e-6),'cl_B_B':cl(2e-6)}
+    cij,resid = cij_poly_approx(data,return_resid=True)
+    assert cij.shape == (2,2,3*nside)
+    assert np.array_equal(cij[0,1],cij[1,0])
+    assert np.all(np.isfinite(cij))
+    assert np.all(resid < 1e-6)
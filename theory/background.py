@@ -7,14 +7,15 @@
 
 # ingredients
 import numpy as np
-from classy import Class
+from theory.classyCache import getCosmo
 
 def classyBackground(thy_args, zs):
    """
    Computes background quantities relevant for Limber integrals
    using CLASS. Returns OmM (~0.3), chistar (comoving dist [h/Mpc] 
    to the surface of last scatter), Ez (H(z)/H0 evaluated on zs), 
-   and chi (comoving distance [h/Mpc] evaluated on zs).
+   and chi (comoving distance [h/Mpc] evaluated on zs). The CLASS
+   object is drawn from the shared cache in classyCache.py.
    
    Parameters
    ----------
@@ -23,15 +24,7 @@ def classyBackground(thy_args, zs):
    zs: list OR ndarray
       redshifts to evaluate chi(z) and E(z) 
    """
-   omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]
-             
-   params = {'A_s': 1e-10*np.exp(ln10As),'n_s': ns,'h': H0/100., 
-             'N_ur': 2.0328,'N_ncdm': 1,'m_ncdm': Mnu,'tau_reio': 0.0568,
-             'omega_b': omb,'omega_cdm': omc}
-   
-   cosmo = Class()
-   cosmo.set(params)
-   cosmo.compute()
+   cosmo = getCosmo(thy_args)
    
    OmM     = cosmo.Omega0_m()
    zstar   = cosmo.get_current_derived_parameters(['z_rec'])['z_rec']
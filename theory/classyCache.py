@@ -0,0 +1,98 @@
+# A cosmology-keyed cache of computed CLASS objects. Both background.py
+# and pkCodes.py draw from the same (module-level) cache, so that a single
+# likelihood evaluation only requires one Boltzmann solve, no matter how
+# many background/power spectrum wrappers are called.
+
+# ingredients
+import numpy as np
+from collections import OrderedDict
+from classy import Class
+
+def classyParams(thy_args):
+   """
+   Returns the dictionary of CLASS inputs for the cosmology
+   omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]
+
+   The settings are the union of what is needed for background
+   quantities and (linear + halofit) power spectra, such that
+   one computed CLASS object can be shared by all wrappers.
+   """
+   omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]
+   params = {'output': 'mPk','P_k_max_h/Mpc': 20.,'non linear':'halofit','z_pk': '0.0,20',
+             'A_s': 1e-10*np.exp(ln10As),'n_s': ns,'h': H0/100.,
+             'N_ur': 2.0328,'N_ncdm': 1,'m_ncdm': Mnu,'tau_reio': 0.0568,
+             'omega_b': omb,'omega_cdm': omc}
+   return params
+
+class classyCache():
+   """
+   A bounded least-recently-used cache of computed CLASS objects,
+   keyed by the cosmological parameters thy_args[:6]. When the cache
+   is full the least-recently-used object is evicted and its memory
+   is freed with struct_cleanup.
+   """
+   def __init__(self, maxsize=4):
+      """
+      Parameters
+      ----------
+      maxsize: int
+         maximum number of computed CLASS objects held in memory
+      """
+      self.maxsize = maxsize
+      self.cosmos  = OrderedDict()
+      self.hits    = 0
+      self.misses  = 0
+
+   def key(self, thy_args):
+      """
+      Returns the (hashable) cache key for thy_args,
+      i.e. the tuple omb,omc,ns,ln10As,H0,Mnu.
+      """
+      return tuple(float(x) for x in thy_args[:6])
+
+   def get(self, thy_args):
+      """
+      Returns a CLASS object (with perturbations computed) for the
+      cosmology omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]. Only runs
+      CLASS if this cosmology is not already in the cache.
+      """
+      key = self.key(thy_args)
+      if key in self.cosmos:
+         self.hits += 1
+         self.cosmos.move_to_end(key)
+         return self.cosmos[key]
+      self.misses += 1
+      cosmo = Class()
+      cosmo.set(classyParams(thy_args))
+      cosmo.compute()
+      self.cosmos[key] = cosmo
+      while len(self.cosmos) > self.maxsize:
+         _,old = self.cosmos.popitem(last=False)
+         old.struct_cleanup()
+      return cosmo
+
+   def clear(self):
+      """
+      Frees all cached CLASS objects and resets the counters.
+      """
+      for cosmo in self.cosmos.values(): cosmo.struct_cleanup()
+      self.cosmos.clear()
+      self.hits   = 0
+      self.misses = 0
+
+   def stats(self):
+      """
+      Returns a dictionary with the number of cache hits,
+      misses and the current number of cached cosmologies.
+      """
+      return {'hits':self.hits,'misses':self.misses,'size':len(self.cosmos)}
+
+# shared by all wrappers in theory/
+cosmoCache = classyCache()
+
+def getCosmo(thy_args):
+   """
+   Returns a CLASS object (with perturbations computed) for the cosmology
+   omb,omc,ns,ln10As,H0,Mnu = thy_args[:6], drawing from the shared cache.
+   """
+   return cosmoCache.get(thy_args)
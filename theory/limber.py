@@ -1,13 +1,54 @@
 import numpy as np
-from scipy.integrate   import simps
+from scipy.integrate   import simpson,trapezoid
 from scipy.interpolate import interp1d
-from scipy.interpolate import InterpolatedUnivariateSpline as Spline
+from scipy.interpolate import CubicSpline
+
+def splineInterp(x, Y, xnew, cols=None, ext=0):
+   """
+   Cubic spline interpolation of all columns of Y at once. The spline 
+   (with not-a-knot boundary conditions) is identical to that of
+   InterpolatedUnivariateSpline, but it is built for all columns
+   with a single call and evaluated without any Python loops.
+   
+   Parameters
+   ----------
+   x: (Nx) ndarray
+      (increasing) points at which Y is tabulated
+   Y: (Nx,Ncol) ndarray
+      the columns to be interpolated
+   xnew: ndarray
+      points at which to evaluate the spline
+   cols: None OR ndarray of ints, default=None
+      If None, every column is evaluated at every point and the output
+      has shape xnew.shape+(Ncol,). Otherwise cols (which must broadcast
+      against xnew) selects which column to evaluate at each point, and 
+      the output has shape xnew.shape.
+   ext: int, default=0
+      Same as for InterpolatedUnivariateSpline. Extrapolate if ext=0, 
+      return zeros if ext=1 and return the boundary value if ext=3 
+      for points outside of [x[0],x[-1]].
+   """
+   spl = CubicSpline(x,Y,axis=0)
+   if ext==3: xnew = np.clip(xnew,x[0],x[-1])
+   if cols is None: 
+      res = spl(xnew)
+   else:
+      # evaluate the piecewise polynomial (c[0]*dx^3+...+c[3]) 
+      # of the selected column directly
+      idx = np.clip(np.searchsorted(x,xnew)-1,0,len(x)-2)
+      dx  = xnew-x[idx]
+      c   = spl.c[:,idx,cols]
+      res = ((c[0]*dx+c[1])*dx+c[2])*dx+c[3]
+   if ext==1:
+      out = (xnew<x[0])|(xnew>x[-1])
+      res[out] = 0.
+   return res
     
 class limb():
    """
    Calculate Ckg and Cgg within the Limber approximation.
    """
-   def __init__(self, dNdz, thy_fid, Pgm, Pgg, Pmm, background, lmax=1000, Nlval=64, zmin=0.001, zmax=2., Nz=50):
+   def __init__(self, dNdz, thy_fid, Pgm, Pgg, Pmm, background, lmax=1000, Nlval=64, zmin=0.001, zmax=2., Nz=50, PgmPgg=None):
       """
       Parameters
       ----------
@@ -43,6 +84,12 @@ class limb():
          Maximum redshift used for Limber integrals.
       Nz: int
          Number of redshifts used in Limber integrands.
+      PgmPgg: method, optional
+         Batched version of (Pgm, Pgg). Takes (thy_args_list,zs) as inputs, where thy_args_list
+         is a list of Ns thy_args and zs is a (Ns) ndarray, and returns (Pgm_tables,Pgg_tables), 
+         which are (Ns,Nk,1+Nmono_cross) and (Ns,Nk,1+Nmono_auto) ndarrays. Used by evaluateAll
+         to compute the tables for all galaxy samples at once. If None, evaluateAll loops over
+         Pgm and Pgg instead.
       """
       if isinstance(dNdz,str): dNdz = np.loadtxt(dNdz)
       self.Ng    = dNdz.shape[1] - 1
@@ -54,17 +101,24 @@ class limb():
       self.lval  = np.logspace(0,np.log10(lmax),Nlval)
       self.Nl    = len(self.l)
       self.Nlval = len(self.lval)
+      # The cubic spline from lval to l is linear in the Cells, so we precompute
+      # it as a (Nl,Nlval) matrix by splining the identity. Similarly, we precompute
+      # the Simpson weights on the (regular) z-grid, such that \int dchi f(chi) is 
+      # given by np.dot(self.wz/(H0*Ez),f) (see chiWeights).
+      self.Rl    = splineInterp(self.lval,np.eye(self.Nlval),self.l)
+      self.wz    = simpson(np.eye(self.Nz),x=self.z,axis=0)
       # evaluate dNdz on regular grid and normalize it such 
       # that \int dN/dz dz = 1 for each galaxy sample
       self.dNdz  = np.zeros((self.Nz,self.Ng))
       for j in range(self.Ng): self.dNdz[:,j] = np.interp(self.z,dNdz[:,0],dNdz[:,j+1],left=0,right=0)
-      norm       = simps(self.dNdz, x=self.z, axis=0)     # (Ng) ndarray
+      norm       = simpson(self.dNdz, x=self.z, axis=0)     # (Ng) ndarray
       norm       = self.gridMe(norm)
       self.dNdz /= norm
       # store theory predictions 
       self.Pgm         = Pgm
       self.Pgg         = Pgg
       self.Pmm         = Pmm
+      self.PgmPgg      = PgmPgg
       self.background  = background
       # store fiducial cosmology (and set "current cosmology" to fiducial)
       self._thy_fid  = thy_fid
@@ -89,8 +143,8 @@ class limb():
       OmM,chistar,Ez,chi = self.background(self.thy_fid,self.z)
       _,Wg,_             = self.projectionKernels(self.thy_fid)
       def zeff(i):
-         denom  = np.trapz(Wg[:,i]*Wg[:,i]/chi**2,x=chi)
-         numer  = np.trapz(Wg[:,i]*Wg[:,i]*self.z/chi**2,x=chi)
+         denom  = trapezoid(Wg[:,i]*Wg[:,i]/chi**2,x=chi)
+         numer  = trapezoid(Wg[:,i]*Wg[:,i]*self.z/chi**2,x=chi)
          return numer/denom
       self.zeff = np.array([zeff(i) for i in range(self.Ng)])
 
@@ -106,6 +160,7 @@ class limb():
       Pgm_eval     # Pgm tables at each effective z, (Ng,Nk,1+Nmono) ndarray
       Pgg_eval     # Pgm tables at each effective z, (Ng,Nk,1+Nmono) ndarray
       Pmm_eval     # Pmm evaluated at each z in self.z, (Nk,1+Nz) ndarray
+      wchi         # quadrature weights for \int dchi, (Nz) ndarray
 
       Nmono is the number of monomials (e.g. 1, alpha0, ...), which can in 
       general be different for Pgm and Pgg. The "+1" is a column of ks.
@@ -122,7 +177,54 @@ class limb():
       Pgm_eval = self.Pgm(thy_args,self.zeff[i])
       Pgg_eval = self.Pgg(thy_args,self.zeff[i])
       Pmm_eval = self.Pmm(thy_args,self.z)
-      return chi,Wk,Wg_clust,Wg_mag,Pgm_eval,Pgg_eval,Pmm_eval
+      return chi,Wk,Wg_clust,Wg_mag,Pgm_eval,Pgg_eval,Pmm_eval,self.chiWeights(Ez)
+
+   def evaluateAll(self, thy_args):
+      """
+      Same as evaluate, but for all Ng galaxy samples at once. The
+      background, projection kernels and Pmm are evaluated once (for
+      the cosmology of thy_args[0]), while the Pgm and Pgg tables are 
+      evaluated at the effective redshift of each sample, with a single
+      call to self.PgmPgg (if provided). Returns
+      
+      chi          # comoving distance, (Nz) ndarray
+      Wk           # CMB lensing kernel, (Nz) ndarray
+      Wg_clust     # galaxy clustering kernels, (Nz,Ng) ndarray
+      Wg_mag       # galaxy magnification kernels, (Nz,Ng) ndarray
+      Pgm_eval     # Pgm tables at each effective z, (Ng,Nk,1+Nmono) ndarray
+      Pgg_eval     # Pgg tables at each effective z, (Ng,Nk,1+Nmono) ndarray
+      Pmm_eval     # Pmm evaluated at each z in self.z, (Nk,1+Nz) ndarray
+      wchi         # quadrature weights for \int dchi, (Nz) ndarray
+      
+      Parameters
+      ----------
+      thy_args: list
+         list of Ng cosmological inputs (one for each galaxy sample),
+         which are assumed to share the same cosmology
+      """
+      OmM,chistar,Ez,chi = self.background(thy_args[0],self.z)
+      Wk,Wg_clust,Wg_mag = self.projectionKernels(thy_args[0],bkgrnd=[OmM,chistar,Ez,chi])
+      if self.PgmPgg is not None:
+         Pgm_eval,Pgg_eval = self.PgmPgg(thy_args,self.zeff)
+      else:
+         Pgm_eval = np.array([self.Pgm(thy_args[i],self.zeff[i]) for i in range(self.Ng)])
+         Pgg_eval = np.array([self.Pgg(thy_args[i],self.zeff[i]) for i in range(self.Ng)])
+      Pmm_eval = self.Pmm(thy_args[0],self.z)
+      return chi,Wk,Wg_clust,Wg_mag,Pgm_eval,Pgg_eval,Pmm_eval,self.chiWeights(Ez)
+
+   def chiWeights(self, Ez):
+      """
+      Returns the (Nz) ndarray of quadrature weights such that
+      \int dchi f(chi) = np.dot(chiWeights(Ez),f(chi(z))), using 
+      dchi = dz/(H0*Ez) and the precomputed Simpson weights self.wz.
+      
+      Parameters
+      ----------
+      Ez: (Nz) ndarray
+         H(z)/H0 evaluated on self.z
+      """
+      H0 = 100./299792.458 # [h/Mpc] units
+      return self.wz/(H0*Ez)
 
    def gridMe(self,x):
       """
@@ -175,8 +277,6 @@ class limb():
          s  = 'must provide a background code to compute projection kernels'
          raise RuntimeError(s)
          
-      OmM,chistar,Ez,chi = self.background(thy_args,self.z)
-      H0                 = 100./299792.458 # [h/Mpc] units
       if bkgrnd is None: OmM,chistar,Ez,chi = self.background(thy_args,self.z)
       else:              OmM,chistar,Ez,chi = bkgrnd
       H0 = 100./299792.458 # [h/Mpc] units
@@ -223,62 +323,133 @@ class limb():
          magnification bias s_\mu
       """
       # Evaluate projection kernels and power spectra.
-      # The "kgrid" is defined such that kgrid[i,j] = (l[j]+0.5)/chi(z[i])
-      chi,Wk,Wg_clust,Wg_mag,PgmT,PggT,PmmT = self.evaluate(i, thy_args)                 
-      kgrid = (np.tile(self.lval+0.5,self.Nz)/np.repeat(chi,self.Nlval)).reshape((self.Nz,self.Nlval))
+      chi,Wk,Wg_clust,Wg_mag,PgmT,PggT,PmmT,wchi = self.evaluate(i, thy_args)                 
+      kgrid = self.kgrid(chi)
+      Pgrid = self.interpPmm(PmmT,kgrid)
+      return self.assembleCggCkg(chi,wchi,Wk,Wg_clust[:,i],Wg_mag[:,i],PgmT,PggT,Pgrid,kgrid,smag,ext=ext)
+
+   def computeAllCggCkg(self, thy_args, smag, ext=3, resample=True):
+      """
+      Computes Cgg and Ckg for all Ng galaxy samples at once. The background, 
+      projection kernels and Pmm (which only depend on cosmology) are evaluated
+      once, and the Pgm and Pgg tables of all samples are computed with a 
+      single (batched) call if self.PgmPgg is provided.
+      
+      Returns Cgg and Ckg, which are (Ng,Nl,Nmono_tot) ndarrays, where Cgg[i] 
+      and Ckg[i] are equivalent to computeCggCkg(i,thy_args[i],smag[i]).
       
-      Wg_clust   = Wg_clust[:,i]    # (Nz) ndarray
-      Wg_mag     = Wg_mag[:,i]      # (Nz) ndarray
+      Parameters
+      ----------
+      thy_args: list
+         list of Ng cosmological inputs (one for each galaxy sample),
+         which are assumed to share the same cosmology
+      smag: list or ndarray
+         magnification bias s_\mu for each galaxy sample
+      resample: bool, default=True
+         If False, skips the resampling from self.lval to self.l and
+         returns (Ng,Nlval,Nmono_tot) ndarrays evaluated at self.lval.
+         The full-resolution tables are then np.dot(self.Rl,Cgg[i]), which
+         allows any (linear) binning to be folded into a single matrix.
+      """
+      chi,Wk,Wg_clust,Wg_mag,PgmT,PggT,PmmT,wchi = self.evaluateAll(thy_args)
+      kgrid = self.kgrid(chi)
+      Pgrid = self.interpPmm(PmmT,kgrid)
+      Cgg   = []
+      Ckg   = []
+      for i in range(self.Ng):
+         Cgg_,Ckg_ = self.assembleCggCkg(chi,wchi,Wk,Wg_clust[:,i],Wg_mag[:,i],PgmT[i],PggT[i],Pgrid,kgrid,smag[i],ext=ext,resample=resample)
+         Cgg.append(Cgg_)
+         Ckg.append(Ckg_)
+      return np.array(Cgg),np.array(Ckg)
+
+   def kgrid(self, chi):
+      """
+      Returns the (Nz,Nlval) ndarray kgrid[i,j] = (lval[j]+0.5)/chi(z[i])
+      """
+      return (np.tile(self.lval+0.5,self.Nz)/np.repeat(chi,self.Nlval)).reshape((self.Nz,self.Nlval))
+
+   def interpPmm(self, PmmT, kgrid):
+      """
+      Interpolates a Pmm table (see evaluate) onto kgrid, where
+      the i'th row of kgrid is evaluated with the i'th redshift.
+      Returns a (Nz,Nlval) ndarray.
+      """
+      rows = np.arange(self.Nz)[:,None]
+      return splineInterp(PmmT[:,0],PmmT[:,1:],kgrid,cols=rows,ext=1)
+
+   def assembleCggCkg(self, chi, wchi, Wk, Wg_clust, Wg_mag, PgmT, PggT, Pgrid, kgrid, smag, ext=3, resample=True):
+      """
+      Assembles the Cgg and Ckg tables (see computeCggCkg) for a single
+      galaxy sample from the projection kernels and power spectra.
+      
+      Parameters
+      ----------
+      chi: (Nz) ndarray
+         comoving distance
+      wchi: (Nz) ndarray
+         quadrature weights for \int dchi (see chiWeights)
+      Wk: (Nz) ndarray
+         CMB lensing kernel
+      Wg_clust: (Nz) ndarray
+         galaxy clustering kernel for this sample
+      Wg_mag: (Nz) ndarray
+         galaxy magnification kernel for this sample
+      PgmT: (Nk,1+Nmono_cros) ndarray
+         Pgm table at the effective redshift of this sample
+      PggT: (Nk,1+Nmono_auto) ndarray
+         Pgg table at the effective redshift of this sample
+      Pgrid: (Nz,Nlval) ndarray
+         Pmm interpolated onto kgrid (see interpPmm)
+      kgrid: (Nz,Nlval) ndarray
+         see kgrid
+      smag: float
+         magnification bias s_\mu
+      resample: bool, default=True
+         If False, returns the tables evaluated at self.lval
+         rather than at self.l (see computeAllCggCkg)
+      """
       Nmono_auto = PggT.shape[1]-1  # number of monomials for auto
       Nmono_cros = PgmT.shape[1]-1  # number of monomials for cross
       
-      # interpolate
-      PggIntrp = np.zeros(kgrid.shape+(Nmono_auto,))
-      PgmIntrp = np.zeros(kgrid.shape+(Nmono_cros,))
-      for j in range(Nmono_auto): PggIntrp[:,:,j] = Spline(PggT[:,0],PggT[:,j+1],ext=ext)(kgrid)
-      for j in range(Nmono_cros): PgmIntrp[:,:,j] = Spline(PgmT[:,0],PgmT[:,j+1],ext=ext)(kgrid)
-      Pgrid = np.zeros((self.Nz,self.Nlval)) # kgrid.shape
-      for j in range(self.Nz): 
-         Pgrid[j,:] = Spline(PmmT[:,0],PmmT[:,j+1],ext=1)(kgrid[j,:])
+      # interpolate every monomial onto kgrid at once, (Nz,Nlval,Nmono) ndarrays
+      PggIntrp = splineInterp(PggT[:,0],PggT[:,1:],kgrid,ext=ext)
+      PgmIntrp = splineInterp(PgmT[:,0],PgmT[:,1:],kgrid,ext=ext)
           
       # assume that mono_auto = 1, auto1, auto2, ... AND ADD SHOT NOISE
       # and that    mono_cros = 1, cros1, cros2, ...
       Nmono_tot = 1 + Nmono_auto + (Nmono_cros-1)
-      def reshape_kernel(kernel): return np.repeat(kernel/chi**2.,self.Nlval).reshape(kgrid.shape)    
-          
+      def reshape_kernel(kernel): return (kernel/chi**2.)[:,None]
+      
+      # Stack the integrands of Cgg and Ckg for all monomials into a 
+      # single (Nz,Nlval,2*Nmono_tot) ndarray, such that the chi integral 
+      # (a weighted sum) and the resampling in ell (a matrix multiply) 
+      # are both done in one go. The shot noise 
+      # columns (Nmono_auto) are left as zeros and are added at the end.
+      integrand = np.zeros(kgrid.shape+(2*Nmono_tot,))
+      gg = integrand[:,:,:Nmono_tot] # views
+      kg = integrand[:,:,Nmono_tot:]
       ##### Cgg
-      Cgg = np.ones((self.Nl,Nmono_tot))
-      # the "1" piece
-      integrand  = reshape_kernel(Wg_clust**2)                  * PggIntrp[:,:,0]
-      integrand += 2*(5*smag-2)*reshape_kernel(Wg_mag*Wg_clust) * PgmIntrp[:,:,0]
-      integrand += (5*smag-2)**2*reshape_kernel(Wg_mag**2)      * Pgrid
-      integral   = simps(integrand,x=chi,axis=0)
-      Cgg[:,0]   = Spline(self.lval,integral)(self.l)
-      # the mono_auto pieces
-      for j in range(Nmono_auto-1):
-         integrand  = reshape_kernel(Wg_clust**2) * PggIntrp[:,:,j+1]
-         integral   = simps(integrand,x=chi,axis=0)
-         Cgg[:,j+1] = Spline(self.lval,integral)(self.l)
-      # adding shot noise (already ones)
+      # the "1" and the mono_auto pieces
+      gg[:,:,:Nmono_auto]   = reshape_kernel(Wg_clust**2)[:,:,None] * PggIntrp
       # the mono_cros pieces
-      for j in range(Nmono_cros-1):
-         integrand = 2*(5*smag-2)*reshape_kernel(Wg_clust*Wg_mag) * PgmIntrp[:,:,j+1]
-         integral  = simps(integrand,x=chi,axis=0)
-         Cgg[:,j+1+Nmono_auto] = Spline(self.lval,integral)(self.l)
-      
+      gg[:,:,Nmono_auto+1:] = 2*(5*smag-2)*reshape_kernel(Wg_clust*Wg_mag)[:,:,None] * PgmIntrp[:,:,1:]
+      # the rest of the "1" piece
+      gg[:,:,0] += 2*(5*smag-2)*reshape_kernel(Wg_mag*Wg_clust) * PgmIntrp[:,:,0]
+      gg[:,:,0] += (5*smag-2)**2*reshape_kernel(Wg_mag**2)      * Pgrid
       ##### Ckg
-      Ckg = np.zeros((self.Nl,Nmono_tot))
-      # the "1" piece
-      integrand  = reshape_kernel(Wk*Wg_clust)          * PgmIntrp[:,:,0]
-      integrand += (5*smag-2)*reshape_kernel(Wk*Wg_mag) * Pgrid
-      integral   = simps(integrand,x=chi,axis=0)
-      Ckg[:,0]   = Spline(self.lval,integral)(self.l)  
       # the mono_auto pieces are zero (including shot noise)          
-      # the mono_cros pieces
-      for j in range(Nmono_cros-1):
-         integrand = reshape_kernel(Wk*Wg_clust) * PgmIntrp[:,:,j+1]
-         integral  = simps(integrand,x=chi,axis=0) 
-         Ckg[:,j+1+Nmono_auto] = Spline(self.lval,integral)(self.l)
+      # the "1" and the mono_cros pieces
+      kg[:,:,0]             = reshape_kernel(Wk*Wg_clust)                 * PgmIntrp[:,:,0]
+      kg[:,:,0]            += (5*smag-2)*reshape_kernel(Wk*Wg_mag)        * Pgrid
+      kg[:,:,Nmono_auto+1:] = reshape_kernel(Wk*Wg_clust)[:,:,None]       * PgmIntrp[:,:,1:]
+      
+      integral = np.tensordot(wchi,integrand,axes=(0,0))
+      Cells    = np.dot(self.Rl,integral) if resample else integral
+      Cgg      = Cells[:,:Nmono_tot]
+      Ckg      = Cells[:,Nmono_tot:]
+      # adding shot noise
+      Cgg[:,Nmono_auto] = 1.
+      Ckg[:,Nmono_auto] = 0.
           
       return Cgg,Ckg
 
@@ -296,7 +467,7 @@ class limb():
       OmM,chistar,Ez,chi = self.background(thy_args_,self.z)
       Wk,Wg_clust,Wg_mag = self.projectionKernels(thy_args_,bkgrnd=[OmM,chistar,Ez,chi])
       PmmT  = self.Pmm(thy_args_,self.z)              
-      kgrid = (np.tile(self.lval+0.5,self.Nz)/np.repeat(chi,self.Nlval)).reshape((self.Nz,self.Nlval))
+      kgrid = self.kgrid(chi)
       
       PgmT = np.zeros_like(PmmT); PgmT[:,0] = PmmT[:,0].copy()
       PggT = np.zeros_like(PmmT); PggT[:,0] = PmmT[:,0].copy()
@@ -311,13 +482,10 @@ class limb():
       Wgj_clust   = Wg_clust[:,j]    # (Nz) ndarray
       Wgj_mag     = Wg_mag[:,j]      # (Nz) ndarray
               
-      PgmGrid = np.zeros_like(kgrid)   
-      PggGrid = np.zeros_like(kgrid) 
-      PmmGrid = np.zeros_like(kgrid) 
-      for k in range(self.Nz): 
-         PgmGrid[k,:] = Spline(PgmT[:,0],PgmT[:,k+1],ext=1)(kgrid[k,:])   
-         PggGrid[k,:] = Spline(PggT[:,0],PggT[:,k+1],ext=1)(kgrid[k,:])   
-         PmmGrid[k,:] = Spline(PmmT[:,0],PmmT[:,k+1],ext=1)(kgrid[k,:])
+      rows    = np.arange(self.Nz)[:,None]
+      PgmGrid = splineInterp(PgmT[:,0],PgmT[:,1:],kgrid,cols=rows,ext=1)
+      PggGrid = splineInterp(PggT[:,0],PggT[:,1:],kgrid,cols=rows,ext=1)
+      PmmGrid = self.interpPmm(PmmT,kgrid)
           
       def reshape_kernel(kernel): return np.repeat(kernel/chi**2.,self.Nlval).reshape(kgrid.shape)    
           
@@ -326,8 +494,8 @@ class limb():
       integrand += reshape_kernel((5*smag(self.z)-2)*Wgi_mag*Wgj_clust)  * PgmGrid
       integrand += reshape_kernel((5*smag(self.z)-2)*Wgj_mag*Wgi_clust)  * PgmGrid
       integrand += reshape_kernel((5*smag(self.z)-2)**2*Wgi_mag*Wgj_mag) * PmmGrid
-      integral   = simps(integrand,x=chi,axis=0)
-      Cgigj      = Spline(self.lval,integral)(self.l)
+      integral   = np.dot(self.chiWeights(Ez),integrand)
+      Cgigj      = np.dot(self.Rl,integral)
           
       return Cgigj
 
@@ -343,7 +511,7 @@ class limb():
       OmM,chistar,Ez,chi = self.background(thy_args_,self.z)
       Wk,Wg_clust,Wg_mag = self.projectionKernels(thy_args_,bkgrnd=[OmM,chistar,Ez,chi])
       PmmT  = self.Pmm(thy_args_,self.z)              
-      kgrid = (np.tile(self.lval+0.5,self.Nz)/np.repeat(chi,self.Nlval)).reshape((self.Nz,self.Nlval))
+      kgrid = self.kgrid(chi)
       
       PgmT = np.zeros_like(PmmT); PgmT[:,0] = PmmT[:,0].copy()
       for k,z in enumerate(self.z):
@@ -353,18 +521,16 @@ class limb():
       Wgi_clust   = Wg_clust[:,i]    # (Nz) ndarray
       Wgi_mag     = Wg_mag[:,i]      # (Nz) ndarray
               
-      PgmGrid = np.zeros_like(kgrid)   
-      PmmGrid = np.zeros_like(kgrid) 
-      for k in range(self.Nz): 
-         PgmGrid[k,:] = Spline(PgmT[:,0],PgmT[:,k+1],ext=1)(kgrid[k,:])     
-         PmmGrid[k,:] = Spline(PmmT[:,0],PmmT[:,k+1],ext=1)(kgrid[k,:])
+      rows    = np.arange(self.Nz)[:,None]
+      PgmGrid = splineInterp(PgmT[:,0],PgmT[:,1:],kgrid,cols=rows,ext=1)
+      PmmGrid = self.interpPmm(PmmT,kgrid)
           
       def reshape_kernel(kernel): return np.repeat(kernel/chi**2.,self.Nlval).reshape(kgrid.shape)    
           
       ##### Ckgi
       integrand  = reshape_kernel(Wk*Wgi_clust)                  * PgmGrid
       integrand += reshape_kernel((5*smag(self.z)-2)*Wk*Wgi_mag) * PmmGrid
-      integral   = simps(integrand,x=chi,axis=0)
-      Ckgi       = Spline(self.lval,integral)(self.l)
+      integral   = np.dot(self.chiWeights(Ez),integrand)
+      Ckgi       = np.dot(self.Rl,integral)
           
       return Ckgi
\ No newline at end of file
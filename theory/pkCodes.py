@@ -1,6 +1,6 @@
 # ingredients
 import numpy as np
-from classy import Class
+from theory.classyCache import getCosmo
 from velocileptors.LPT.cleft_fftw import CLEFT
 from aemulus_heft.heft_emu import NNHEFTEmulator
 
@@ -12,25 +12,42 @@ ks = np.concatenate(([0.0005,],\
 # aemulus nu HEFT emulator
 nnemu = NNHEFTEmulator()
 
-def getCosmo(thy_args):
+def pkTable(cosmo,k,z,nonlinear=True,cb=False):
    """
-   Returns a CLASS object (with perturbations computed) for the cosmology
-   omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]
+   Returns a (Nk,Nz) ndarray of the power spectrum [(Mpc/h)^3] evaluated
+   at each k [h/Mpc] and z, using CLASS's bulk array interface, i.e. a 
+   single call into CLASS rather than one call per (k,z).
+
+   Parameters
+   ----------
+   cosmo: CLASS object
+      with perturbations computed (see getCosmo)
+   k: ndarray
+      wavevectors [h/Mpc]
+   z: float OR ndarray
+      redshift(s)
+   nonlinear: bool, default=True
+      if True returns the halofit power spectrum, else the linear one
+   cb: bool, default=False
+      if True returns the cold dark matter + baryon power spectrum, 
+      else the total matter power spectrum
    """
-   omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]       
-   params = {'output': 'mPk','P_k_max_h/Mpc': 20.,'non linear':'halofit','z_pk': '0.0,20',
-             'A_s': 1e-10*np.exp(ln10As),'n_s': ns,'h': H0/100., 
-             'N_ur': 2.0328,'N_ncdm': 1,'m_ncdm': Mnu,'tau_reio': 0.0568,
-             'omega_b': omb,'omega_cdm': omc}
-   cosmo = Class()
-   cosmo.set(params)
-   cosmo.compute()
-   return cosmo
+   h  = cosmo.h()
+   kk = np.ascontiguousarray(k,dtype='float64')*h
+   zz = np.ascontiguousarray(np.atleast_1d(z),dtype='float64')
+   Nk = len(kk) ; Nz = len(zz)
+   if cb: pk = cosmo.get_pk_cb_array(kk,zz,Nk,Nz,int(nonlinear))
+   else:  pk = cosmo.get_pk_array(kk,zz,Nk,Nz,int(nonlinear))
+   # CLASS returns a flattened array with z as the slow index
+   return pk.reshape((Nz,Nk)).T*h**3
 
 # These are thin wrappers around various cosmology/PT/emulator codes for
 # real-space power spectra. Each method should have (thy_args, z) as its 
 # arguments. 
 #
+# The exception is pgmpggHEFT, a batched method that takes a list of 
+# thy_args and a list of redshifts and returns both Pgm and Pgg.
+#
 # Currently wrapped:
 # - Pgg with Halofit, velocileptors, Aemulus emulator
 # - Pgm with Hallofit velocileptors, Aemulus emulator
@@ -44,13 +61,12 @@ def pmmHalofit(thy_args,z):
    omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]
    z is a (Nz) ndarray
    """
-   k = np.logspace(np.log10(0.005),np.log10(5.),200)
-   cosmo = getCosmo(thy_args)
-   h = cosmo.h()
-   Pk = lambda zz: np.array([cosmo.pk(kk*h,zz)*h**3 for kk in k])
-   if isinstance(z, (np.floating, float)): return np.array([k,Pk(z)]).T
-   else: res = [Pk(zz) for zz in z]
-   return np.array([k]+res).T
+   k   = np.logspace(np.log10(0.005),np.log10(5.),200)
+   Pk  = pkTable(getCosmo(thy_args),k,z)
+   res = np.zeros((len(k),1+Pk.shape[1]))
+   res[:,0]  = k
+   res[:,1:] = Pk
+   return res
 
 def pggHalofit(thy_args,z):
    """
@@ -60,11 +76,9 @@ def pggHalofit(thy_args,z):
    omb,omc,ns,ln10As,H0,Mnu,b1 = thy_args[:7]
    z is a float
    """
-   k = np.logspace(np.log10(0.005),np.log10(5.),200)
-   cosmo = getCosmo(thy_args)
-   h = cosmo.h()
-   Pk = lambda zz: np.array([cosmo.pk(kk*h,zz)*h**3 for kk in k])
-   return np.array([k,thy_args[6]**2*Pk(z)]).T
+   k  = np.logspace(np.log10(0.005),np.log10(5.),200)
+   Pk = pkTable(getCosmo(thy_args),k,z)[:,0]
+   return np.array([k,thy_args[6]**2*Pk]).T
 
 def pgmHalofit(thy_args,z):
    """
@@ -74,11 +88,9 @@ def pgmHalofit(thy_args,z):
    omb,omc,ns,ln10As,H0,Mnu,b1 = thy_args[:7]
    z is a float
    """
-   k = np.logspace(np.log10(0.005),np.log10(5.),200)
-   cosmo = getCosmo(thy_args)
-   h = cosmo.h()
-   Pk = lambda zz: np.array([cosmo.pk(kk*h,zz)*h**3 for kk in k])
-   return np.array([k,thy_args[6]*Pk(z)]).T
+   k  = np.logspace(np.log10(0.005),np.log10(5.),200)
+   Pk = pkTable(getCosmo(thy_args),k,z)[:,0]
+   return np.array([k,thy_args[6]*Pk]).T
 
 def ptableVelocileptors(thy_args,z,k=None,extrap_min=-5,extrap_max=3):
    """
@@ -87,9 +99,8 @@ def ptableVelocileptors(thy_args,z,k=None,extrap_min=-5,extrap_max=3):
    omb,omc,ns,ln10As,H0,Mnu,b1,b2,bs = thy_args
    if k is None: k = ks
    cosmo = getCosmo(thy_args)
-   h     = cosmo.h()
    klin  = np.logspace(-3,np.log10(20.),4000)
-   plin  = np.array([cosmo.pk_cb_lin(kk*h,z)*h**3 for kk in klin])
+   plin  = pkTable(cosmo,klin,z,nonlinear=False,cb=True)[:,0]
    cleft = CLEFT(klin,plin,cutoff=5.,extrap_min=extrap_min,extrap_max=extrap_max)
    cleft.make_ptable(kmin=min(k),kmax=max(k),nk=len(k))
    return cleft.pktable
@@ -115,9 +126,8 @@ def pggVelocileptors(thy_args,z,k=None,extrap_min=-5,extrap_max=3):
    omb,omc,ns,ln10As,H0,Mnu,b1,b2,bs = thy_args
    if k is None: k = ks
    cosmo = getCosmo(thy_args)
-   h     = cosmo.h()
    klin  = np.logspace(-3,np.log10(20.),4000)
-   plin  = np.array([cosmo.pk_cb_lin(kk*h,z)*h**3 for kk in klin])
+   plin  = pkTable(cosmo,klin,z,nonlinear=False,cb=True)[:,0]
    cleft = CLEFT(klin,plin,cutoff=5.,extrap_min=extrap_min,extrap_max=extrap_max)
    cleft.make_ptable(kmin=min(k),kmax=max(k),nk=len(k))
    kout,za  = cleft.pktable[:,0],cleft.pktable[:,13]   
@@ -148,10 +158,9 @@ def pgmVelocileptors(thy_args,z,k=None):
    omb,omc,ns,ln10As,H0,Mnu,b1,b2,bs = thy_args
    if k is None: k = ks
    cosmo = getCosmo(thy_args)
-   h     = cosmo.h()
    klin  = np.logspace(-3,np.log10(20.),4000) # more ks are cheap
-   plin  = np.array([cosmo.pk_cb_lin(kk*h,z)*h**3 for kk in klin])
-   plin *= np.array([cosmo.pk_lin(kk*h,z)*h**3 for kk in klin])
+   plin  = pkTable(cosmo,klin,z,nonlinear=False,cb=True)[:,0]
+   plin *= pkTable(cosmo,klin,z,nonlinear=False)[:,0]
    plin  = np.sqrt(plin)
    cleft = CLEFT(klin,plin,cutoff=5.)
    cleft.make_ptable(kmin=min(k),kmax=max(k),nk=len(k))
@@ -191,15 +200,53 @@ def ptableHEFT(thy_args,z):
    1-1, 1-cb, cb-cb, delta-1, delta-cb, delta-delta, delta2-1, delta2-cb, 
    delta2-delta, delta2-delta2, s2-1, s2-cb, s2-delta, s2-delta2, s2-s2.
    """
-   omb,omc,ns,ln10As,H0,Mnu = thy_args[:6]
-   Mnu   = max(Mnu,0.01) # HEFT is only valid for 0.01 < Mnu < 0.5 
-   cosmo = np.atleast_2d([omb, omc, -1., ns, np.exp(ln10As)/10., H0, Mnu, z])
+   return ptablesHEFT([thy_args],[z])[0]
+
+def ptablesHEFT(thy_args,zs):
+   """
+   Batched version of ptableHEFT. Assumes thy_args is a list of Ns 
+   parameter sets (each with [omb,omc,ns,ln10As,H0,Mnu] = thy_args[i][:6]) 
+   and zs is a (Ns) list or ndarray of redshifts.
+   
+   Returns a (Ns,Nk,1+Nmono) ndarray, where res[i] is the monomial table
+   (see ptableHEFT) for thy_args[i] at zs[i]. All Ns tables are computed
+   with a single call to the emulator.
+   """
+   cosmo = np.zeros((len(zs),8))
+   for i,(prm,z) in enumerate(zip(thy_args,zs)):
+      omb,omc,ns,ln10As,H0,Mnu = prm[:6]
+      Mnu      = max(Mnu,0.01) # HEFT is only valid for 0.01 < Mnu < 0.5 
+      cosmo[i] = [omb, omc, -1., ns, np.exp(ln10As)/10., H0, Mnu, z]
    k_nn, spec_heft_nn = nnemu.predict(cosmo)
-   Nmono     = spec_heft_nn.shape[1]
-   res       = np.zeros((len(k_nn),Nmono+1))
-   res[:,0]  = k_nn
-   res[:,1:] = np.swapaxes(spec_heft_nn[0,:,:],0,1)
+   Nmono        = spec_heft_nn.shape[1]
+   res          = np.zeros((len(zs),len(k_nn),Nmono+1))
+   res[:,:,0]   = k_nn
+   res[:,:,1:]  = np.swapaxes(spec_heft_nn,1,2)
    return res
+
+def pgmFromPtable(T,b1,b2,bs):
+   """
+   Combines a HEFT monomial table T (see ptableHEFT) into a Pgm table
+   for the bias parameters (b1,b2,bs). See pgmHEFT for the output format.
+   """
+   bterms_gm = np.array([0, 1, 0, b1, 0, 0, 0.5*b2, 0, 0, 0, bs, 0, 0, 0, 0])
+   res       = np.zeros((T.shape[0],3))
+   res[:,0]  = T[:,0]
+   res[:,1]  = np.dot(T[:,1:],bterms_gm) # bias-contribution
+   res[:,2]  = -0.5 * T[:,0]**2 * T[:,1] # counterterm
+   return res  
+
+def pggFromPtable(T,b1,b2,bs):
+   """
+   Combines a HEFT monomial table T (see ptableHEFT) into a Pgg table
+   for the bias parameters (b1,b2,bs). See pggHEFT for the output format.
+   """
+   bterms_gg = np.array([0, 0, 1, 0, 2*b1, b1**2, 0, b2, b2*b1, 0.25*b2**2, 0, 2*bs, 2*bs*b1, bs*b2, bs**2])
+   res       = np.zeros((T.shape[0],3))
+   res[:,0]  = T[:,0]
+   res[:,1]  = np.dot(T[:,1:],bterms_gg) # bias-contribution
+   res[:,2]  = -0.5 * T[:,0]**2 * T[:,2] # counterterm
+   return res  
    
 def pgmHEFT(thy_args,z):
    """
@@ -212,13 +259,7 @@ def pgmHEFT(thy_args,z):
    The full prediction is res[:,1] + alpha_x * res[:,2]
    """
    omb,omc,ns,ln10As,H0,Mnu,b1,b2,bs = thy_args
-   bterms_gm = np.array([0, 1, 0, b1, 0, 0, 0.5*b2, 0, 0, 0, bs, 0, 0, 0, 0])
-   T         = ptableHEFT(thy_args,z)
-   res       = np.zeros((T.shape[0],3))
-   res[:,0]  = T[:,0]
-   res[:,1]  = np.dot(T[:,1:],bterms_gm) # bias-contribution
-   res[:,2]  = -0.5 * T[:,0]**2 * T[:,1] # counterterm
-   return res  
+   return pgmFromPtable(ptableHEFT(thy_args,z),b1,b2,bs)
   
 def pggHEFT(thy_args,z):
    """
@@ -231,13 +272,22 @@ def pggHEFT(thy_args,z):
    The full prediction is res[:,1] + alpha_a * res[:,2]
    """
    omb,omc,ns,ln10As,H0,Mnu,b1,b2,bs = thy_args
-   bterms_gg = np.array([0, 0, 1, 0, 2*b1, b1**2, 0, b2, b2*b1, 0.25*b2**2, 0, 2*bs, 2*bs*b1, bs*b2, bs**2])
-   T         = ptableHEFT(thy_args,z)
-   res       = np.zeros((T.shape[0],3))
-   res[:,0]  = T[:,0]
-   res[:,1]  = np.dot(T[:,1:],bterms_gg) # bias-contribution
-   res[:,2]  = -0.5 * T[:,0]**2 * T[:,2] # counterterm
-   return res  
+   return pggFromPtable(ptableHEFT(thy_args,z),b1,b2,bs)
+
+def pgmpggHEFT(thy_args,zs):
+   """
+   Batched version of (pgmHEFT, pggHEFT). Assumes thy_args is a list of
+   Ns parameter sets [omb,omc,ns,ln10As,H0,Mnu,b1,b2,bs] (e.g. one per 
+   galaxy sample) and zs is a (Ns) list or ndarray of redshifts.
+   
+   Returns (Pgm,Pgg), each a (Ns,Nk,3) ndarray, where Pgm[i] = pgmHEFT(thy_args[i],zs[i])
+   and Pgg[i] = pggHEFT(thy_args[i],zs[i]). Since Pgm and Pgg share the same
+   monomial table, only one (batched) call to the emulator is made.
+   """
+   T   = ptablesHEFT(thy_args,zs)
+   Pgm = np.array([pgmFromPtable(T[i],*thy_args[i][6:9]) for i in range(len(zs))])
+   Pgg = np.array([pggFromPtable(T[i],*thy_args[i][6:9]) for i in range(len(zs))])
+   return Pgm,Pgg
 
 def pgmHEFTexpanded(thy_args,z):
    """